@@ -4,6 +4,7 @@
 import os, sys, re
 import io
 import getopt
+import shlex
 from os.path import join, exists, dirname, basename
 from testing import Tester, contents, interpret_problem
 
@@ -11,6 +12,8 @@ PYTHON = os.environ.get('PYTHON', 'python3')
 
 PROGRAM = f"{PYTHON} {join(dirname(__file__),'test-ataxx')}"
 
+CACHE_DIR = ".tester-cache"
+
 os.environ.pop('DISPLAY', None)
 
 def safe_remove(files):
@@ -60,6 +63,16 @@ class Proj2_Tester(Tester):
         return " ".join([ fullname for _, fullname, _
                           in self.input_files(testid) ])
 
+    def command_argv(self, testid):
+        return shlex.split(self.tested_program) \
+            + [ fullname for _, fullname, _ in self.input_files(testid) ]
+
+    def command_stdin(self, testid):
+        return None
+
+    def resource_limits(self, testid):
+        return []
+
     def output_filter(self, id, text):
         text = re.sub(r'(?m)(?:#.*|[ \t]+$)', '', text)
         text = re.sub(r'(?m)(?:^\r?\n)', '', text)
@@ -72,7 +85,7 @@ class Proj2_Tester(Tester):
                     in zip(self.output_files(id),
                            self.standard_output_files(id)):
                 if self.output_filter(id, contents(output)) \
-                       != self.output_filter(id, contents(std)):
+                       != self.expected_output(id, std, self.output_filter):
                     self.reason = "Output(s) do not all match expected output(s)."
                     return
         elif not self.stderr.strip():
@@ -88,11 +101,57 @@ class Proj2_Tester(Tester):
 
 show = None
 keep = False
+jobs = 1
+stats = False
+use_cache = True
+reorder = True
+bench_runs = 0
+bench_output = bench_baseline = None
+bench_threshold = 0.1
+shard = None
+merge = False
+diff_context = 3
+json_report = junit_report = None
 try:
-    opts, args = getopt.getopt(sys.argv[1:], '', ['show=', 'keep', 'PYTHON='])
+    opts, args = getopt.getopt(sys.argv[1:], 'j:',
+                               ['show=', 'keep', 'PYTHON=', 'jobs=',
+                                'stats', 'json=', 'junit=', 'no-cache',
+                                'in-order', 'bench=', 'bench-out=',
+                                'baseline=', 'threshold=', 'shard=',
+                                'merge', 'context=', 'full'])
     for opt, val in opts:
         if opt == '--show':
             show = int(val)
+        elif opt == '--bench':
+            bench_runs = int(val)
+        elif opt == '--bench-out':
+            bench_output = val
+        elif opt == '--baseline':
+            bench_baseline = val
+        elif opt == '--threshold':
+            bench_threshold = float(val) / 100
+        elif opt == '--shard':
+            shard = tuple(map(int, val.split('/')))
+            if len(shard) != 2 or not 1 <= shard[0] <= shard[1]:
+                raise ValueError(val)
+        elif opt == '--merge':
+            merge = True
+        elif opt == '--context':
+            diff_context = int(val)
+        elif opt == '--full':
+            diff_context = None
+        elif opt == '--in-order':
+            reorder = False
+        elif opt == '--no-cache':
+            use_cache = False
+        elif opt == '--stats':
+            stats = True
+        elif opt == '--json':
+            json_report = val
+        elif opt == '--junit':
+            junit_report = val
+        elif opt in ('-j', '--jobs'):
+            jobs = int(val)
         elif opt == '--keep':
             keep = True
         elif opt == '--PYTHON':
@@ -101,11 +160,26 @@ try:
         else:
             assert False
 except:
-    print("Usage: python3 tester.py [--show=N] [--PYTHON=python] TEST.in...",
+    print("Usage: python3 tester.py [--show=N] [--PYTHON=python] [-j N] "
+          "[--stats] [--json=FILE] [--junit=FILE] "
+          "[--no-cache] [--in-order] [--bench=N] [--bench-out=FILE] "
+          "[--baseline=FILE] [--threshold=PERCENT] [--shard=I/N] "
+          "[--context=N] [--full] TEST.in...\n"
+          "       python3 tester.py --merge [--json=FILE] [--junit=FILE] "
+          "SHARD.json...",
           file=sys.stderr)
     sys.exit(1)
 
 tester = Proj2_Tester(tested_program=PROGRAM, report_limit=show,
-                      report_char_limit=10000, keep=keep)
-
+                      report_char_limit=10000, keep=keep, jobs=jobs,
+                      cache_dir=CACHE_DIR, show_usage=stats,
+                      json_report=json_report, junit_report=junit_report,
+                      result_cache=use_cache, reorder=reorder,
+                      bench_runs=bench_runs, bench_output=bench_output,
+                      bench_baseline=bench_baseline,
+                      bench_threshold=bench_threshold, shard=shard,
+                      diff_context=diff_context)
+
+if merge:
+    sys.exit(0 if tester.merge_reports(args) else 1)
 sys.exit(0 if tester.test_all(args) else 1)
@@ -0,0 +1,483 @@
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileInputStream;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.MalformedURLException;
+import java.net.URISyntaxException;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.concurrent.ConcurrentHashMap;
+
+/** Runs the main program of a tested class repeatedly in a single JVM,
+ *  on behalf of a Python test driver, so that each test need not pay for
+ *  JVM startup.  Usage:
+ *
+ *      java [ JVM-OPTIONS ] MainServer [ --merge-stderr ] CLASS
+ *
+ *  Requests arrive on the standard input and responses leave on the
+ *  standard output.  Integers are 4-byte big-endian values, and a
+ *  "block" is an integer length followed by that many bytes:
+ *
+ *      request:  N, followed by N blocks (the UTF-8 encoded program
+ *                arguments), followed by one block (the standard input).
+ *      response: exit code, then a block containing the standard output,
+ *                then a block containing the standard error (empty with
+ *                --merge-stderr, which sends both to the standard output),
+ *                then 1 if this server is about to exit, and 0 otherwise.
+ *
+ *  Each run loads the tested classes in a fresh class loader, so that no
+ *  static state survives from one run to the next.  The next loader is
+ *  created and filled with the classes of CLASS's package while the server
+ *  is idle.  As they are loaded, calls to System.exit in tested classes are
+ *  redirected to MainServer.exit, which ends the run rather than the JVM.
+ *  A run ends as a normal program would: on a call to System.exit, or when
+ *  all of its non-daemon threads have finished.  If a run leaves threads
+ *  running, the server reports its result and then exits.
+ */
+public class MainServer {
+
+    /** Serve requests to run CLASS.main, as described above, where ARGS
+     *  is [ --merge-stderr ] CLASS. */
+    public static void main(String... args) throws IOException {
+        boolean merge = args.length > 1 && args[0].equals("--merge-stderr");
+        MainServer server = new MainServer(args[args.length - 1], merge);
+        DataInputStream requests =
+            new DataInputStream(new BufferedInputStream(
+                new FileInputStream(FileDescriptor.in)));
+        DataOutputStream responses =
+            new DataOutputStream(new BufferedOutputStream(
+                new FileOutputStream(FileDescriptor.out)));
+
+        while (true) {
+            String[] progArgs;
+            try {
+                progArgs = new String[requests.readInt()];
+            } catch (EOFException excp) {
+                return;
+            }
+            for (int i = 0; i < progArgs.length; i += 1) {
+                progArgs[i] =
+                    new String(readBlock(requests), StandardCharsets.UTF_8);
+            }
+            byte[] input = readBlock(requests);
+
+            server.run(progArgs, input);
+
+            responses.writeInt(server._code);
+            writeBlock(responses, server._out.toByteArray());
+            writeBlock(responses,
+                       merge ? new byte[0] : server._err.toByteArray());
+            responses.writeInt(server._lingering ? 1 : 0);
+            responses.flush();
+            if (server._lingering) {
+                System.exit(0);
+            }
+            server.prime();
+        }
+    }
+
+    /** Replacement for System.exit(STATUS) in tested classes: records
+     *  STATUS as the exit code of the current run (if none has been
+     *  recorded) and ends the calling thread. */
+    public static void exit(int status) {
+        synchronized (MainServer.class) {
+            if (_exitCode == null) {
+                _exitCode = status;
+            }
+        }
+        throw new Exit();
+    }
+
+    /** Thrown by exit to unwind the thread that called System.exit. */
+    public static class Exit extends Error {
+        /** An Exit with no message or stack trace. */
+        Exit() {
+            super(null, null, false, false);
+        }
+    }
+
+    /** A server for CLASSNAME.main, sending its standard error to its
+     *  standard output iff MERGE. */
+    MainServer(String className, boolean merge) {
+        _className = className;
+        _merge = merge;
+        ArrayList<URL> urls = new ArrayList<>();
+        for (String entry : System.getProperty("java.class.path")
+                 .split(File.pathSeparator)) {
+            try {
+                urls.add(new File(entry).toURI().toURL());
+            } catch (MalformedURLException excp) {
+                /* Ignore unusable class-path entries. */
+            }
+        }
+        _classPath = urls.toArray(new URL[0]);
+        prime();
+    }
+
+    /** Create the class loader for the next run and load into it (without
+     *  initializing) the main class and the other classes in its
+     *  package. */
+    void prime() {
+        _loader = new RunLoader();
+        int dot = _className.lastIndexOf('.');
+        String pkg = dot == -1 ? "" : _className.substring(0, dot + 1);
+        URL dir = _loader.findResource(pkg.replace('.', '/'));
+        if (dir != null && dir.getProtocol().equals("file")) {
+            try {
+                String[] names = new File(dir.toURI()).list();
+                for (String name : names == null ? new String[0] : names) {
+                    if (name.endsWith(".class")) {
+                        preload(pkg + name.substring(0, name.length() - 6));
+                    }
+                }
+            } catch (URISyntaxException | IllegalArgumentException excp) {
+                /* Fall through to loading the main class alone. */
+            }
+        }
+        preload(_className);
+    }
+
+    /** Load class NAME into the next run's loader, if possible. */
+    private void preload(String name) {
+        try {
+            Class.forName(name, false, _loader);
+        } catch (ClassNotFoundException | LinkageError excp) {
+            /* Leave any errors for the run itself to report. */
+        }
+    }
+
+    /** Run _className.main(ARGS) with INPUT as its standard input, setting
+     *  _code, _out, _err, and _lingering from the result. */
+    void run(String[] args, byte[] input) {
+        RunLoader loader = _loader;
+        InputStream stdin = System.in;
+        PrintStream stdout = System.out, stderr = System.err;
+
+        _out = new ByteArrayOutputStream();
+        _err = _merge ? _out : new ByteArrayOutputStream();
+        _exitCode = null;
+        PrintStream out = new PrintStream(_out, true);
+        PrintStream err = _merge ? out : new PrintStream(_err, true);
+        System.setIn(new ByteArrayInputStream(input));
+        System.setOut(out);
+        System.setErr(err);
+
+        RunGroup group = new RunGroup();
+        Thread main = new Thread(group, () -> invokeMain(loader, args),
+                                 "main");
+        group._main = main;
+        main.setContextClassLoader(loader);
+        try {
+            main.start();
+            _lingering = !awaitEnd(group);
+        } finally {
+            out.flush();
+            err.flush();
+            System.setIn(stdin);
+            System.setOut(stdout);
+            System.setErr(stderr);
+        }
+        if (_exitCode != null) {
+            _code = _exitCode;
+        } else {
+            _code = group._failed ? 1 : 0;
+        }
+    }
+
+    /** Wait for the run whose threads are in GROUP to end, either through
+     *  exit or by completion of all its non-daemon threads.  Return true
+     *  iff none of its threads are still alive afterwards. */
+    private boolean awaitEnd(RunGroup group) {
+        try {
+            while (_exitCode == null) {
+                Thread waitee = null;
+                Thread[] threads = new Thread[group.activeCount() + 8];
+                int n = group.enumerate(threads);
+                for (int i = 0; i < n && waitee == null; i += 1) {
+                    if (threads[i].isAlive() && !threads[i].isDaemon()) {
+                        waitee = threads[i];
+                    }
+                }
+                if (waitee == null) {
+                    break;
+                }
+                waitee.join(WAIT_QUANTUM);
+            }
+            if (_exitCode != null) {
+                Thread.sleep(WAIT_QUANTUM);
+            }
+        } catch (InterruptedException excp) {
+            return false;
+        }
+        return group.activeCount() == 0;
+    }
+
+    /** Call _className.main(ARGS), loading it with LOADER. */
+    private void invokeMain(ClassLoader loader, String[] args) {
+        Method main;
+        try {
+            main = Class.forName(_className, true, loader)
+                .getMethod("main", String[].class);
+        } catch (ClassNotFoundException | NoSuchMethodException excp) {
+            System.err.printf("Error: could not find main method in %s%n",
+                              _className);
+            exit(1);
+            return;
+        }
+        try {
+            main.invoke(null, (Object) args);
+        } catch (InvocationTargetException excp) {
+            MainServer.<RuntimeException>rethrow(excp.getCause());
+        } catch (IllegalAccessException excp) {
+            System.err.printf("Error: main method in %s is not accessible%n",
+                              _className);
+            exit(1);
+        }
+    }
+
+    /** Throw EXCP, whether or not it is checked. */
+    @SuppressWarnings("unchecked")
+    private static <T extends Throwable> void rethrow(Throwable excp)
+        throws T {
+        throw (T) excp;
+    }
+
+    /** The threads of one run. */
+    private static class RunGroup extends ThreadGroup {
+        /** An empty group. */
+        RunGroup() {
+            super("run");
+        }
+
+        @Override
+        public void uncaughtException(Thread thread, Throwable excp) {
+            if (excp instanceof Exit) {
+                return;
+            }
+            if (thread == _main) {
+                _failed = true;
+            }
+            super.uncaughtException(thread, excp);
+        }
+
+        /** The main thread of this run. */
+        private Thread _main;
+        /** True iff _main terminated with an uncaught exception. */
+        private volatile boolean _failed;
+    }
+
+    /** A class loader that loads classes on the class path itself (rather
+     *  than delegating first to its parent), redirecting their calls of
+     *  System.exit to MainServer.exit. */
+    private class RunLoader extends URLClassLoader {
+        /** A new loader for the tested classes. */
+        RunLoader() {
+            super(_classPath, MainServer.class.getClassLoader());
+        }
+
+        @Override
+        protected Class<?> loadClass(String name, boolean resolve)
+            throws ClassNotFoundException {
+            synchronized (getClassLoadingLock(name)) {
+                Class<?> result = findLoadedClass(name);
+                if (result == null && isTestedClass(name)) {
+                    byte[] code = classFile(name);
+                    if (code != null) {
+                        result = defineClass(name, code, 0, code.length);
+                    }
+                }
+                if (result == null) {
+                    return super.loadClass(name, resolve);
+                }
+                if (resolve) {
+                    resolveClass(result);
+                }
+                return result;
+            }
+        }
+
+        /** The (rewritten) contents of the class file for class NAME, or
+         *  null if it is not on the class path.  Class files are read only
+         *  once per server. */
+        private byte[] classFile(String name) {
+            byte[] code = CLASS_FILES.get(name);
+            if (code == null) {
+                code = NO_CLASS;
+                URL url = findResource(name.replace('.', '/') + ".class");
+                if (url != null) {
+                    try (InputStream inp = url.openStream()) {
+                        code = redirectExit(readAll(inp));
+                    } catch (IOException excp) {
+                        /* Treat as missing. */
+                    }
+                }
+                CLASS_FILES.put(name, code);
+            }
+            return code == NO_CLASS ? null : code;
+        }
+    }
+
+    /** True iff NAME might be the name of a class of the tested program
+     *  (rather than of the Java platform or of this server). */
+    private static boolean isTestedClass(String name) {
+        return !(name.startsWith("java.") || name.startsWith("javax.")
+                 || name.startsWith("jdk.") || name.startsWith("sun.")
+                 || name.equals("MainServer")
+                 || name.startsWith("MainServer$"));
+    }
+
+    /** The class file CODE modified so that its calls of
+     *  java.lang.System.exit(int) call MainServer.exit(int) instead.  This
+     *  adds two entries to the constant pool (the name MainServer and the
+     *  class it names) and retargets the method references. */
+    static byte[] redirectExit(byte[] code) {
+        int count = u2(code, 8);
+        int[] entries = new int[count];
+        int p = 10;
+        for (int i = 1; i < count; i += 1) {
+            entries[i] = p;
+            switch (code[p]) {
+            case 1:
+                p += 3 + u2(code, p + 1);
+                break;
+            case 3: case 4: case 9: case 10: case 11: case 12: case 17:
+            case 18:
+                p += 5;
+                break;
+            case 5: case 6:
+                p += 9;
+                i += 1;
+                break;
+            case 7: case 8: case 16: case 19: case 20:
+                p += 3;
+                break;
+            case 15:
+                p += 4;
+                break;
+            default:
+                return code;
+            }
+        }
+        int poolEnd = p;
+
+        ArrayList<Integer> exits = new ArrayList<>();
+        for (int i = 1; i < count; i += 1) {
+            int e = entries[i];
+            if (e != 0 && code[e] == 10) {
+                int nameAndType = entries[u2(code, e + 3)];
+                if (utf8(code, entries, entries[u2(code, e + 1)] + 1)
+                        .equals("java/lang/System")
+                    && utf8(code, entries, nameAndType + 1).equals("exit")
+                    && utf8(code, entries, nameAndType + 3).equals("(I)V")) {
+                    exits.add(e);
+                }
+            }
+        }
+        if (exits.isEmpty() || count + 2 > 0xffff) {
+            return code;
+        }
+
+        byte[] name = "MainServer".getBytes(StandardCharsets.UTF_8);
+        ByteArrayOutputStream result =
+            new ByteArrayOutputStream(code.length + name.length + 6);
+        byte[] pool = code.clone();
+        for (int e : exits) {
+            pool[e + 1] = (byte) ((count + 1) >> 8);
+            pool[e + 2] = (byte) (count + 1);
+        }
+        pool[8] = (byte) ((count + 2) >> 8);
+        pool[9] = (byte) (count + 2);
+        result.write(pool, 0, poolEnd);
+        result.write(1);
+        result.write(name.length >> 8);
+        result.write(name.length);
+        result.write(name, 0, name.length);
+        result.write(7);
+        result.write(count >> 8);
+        result.write(count);
+        result.write(code, poolEnd, code.length - poolEnd);
+        return result.toByteArray();
+    }
+
+    /** The unsigned 2-byte value at K in CODE. */
+    private static int u2(byte[] code, int k) {
+        return ((code[k] & 0xff) << 8) | (code[k + 1] & 0xff);
+    }
+
+    /** The string in the Utf8 constant whose index is the 2-byte value at
+     *  K in CODE, where ENTRIES gives the positions of constants. */
+    private static String utf8(byte[] code, int[] entries, int k) {
+        int e = entries[u2(code, k)];
+        if (code[e] != 1) {
+            return "";
+        }
+        return new String(code, e + 3, u2(code, e + 1),
+                          StandardCharsets.UTF_8);
+    }
+
+    /** The remaining contents of INP. */
+    private static byte[] readAll(InputStream inp) throws IOException {
+        ByteArrayOutputStream result = new ByteArrayOutputStream();
+        byte[] buffer = new byte[BUFFER_SIZE];
+        for (int n = inp.read(buffer); n != -1; n = inp.read(buffer)) {
+            result.write(buffer, 0, n);
+        }
+        return result.toByteArray();
+    }
+
+    /** Read and return a length-prefixed block from INP. */
+    private static byte[] readBlock(DataInputStream inp) throws IOException {
+        byte[] result = new byte[inp.readInt()];
+        inp.readFully(result);
+        return result;
+    }
+
+    /** Write DATA to OUT as a length-prefixed block. */
+    private static void writeBlock(DataOutputStream out, byte[] data)
+        throws IOException {
+        out.writeInt(data.length);
+        out.write(data);
+    }
+
+    /** Milliseconds between checks for the end of a run. */
+    private static final long WAIT_QUANTUM = 20;
+    /** Size of buffer used to read class files. */
+    private static final int BUFFER_SIZE = 1 << 16;
+    /** Marks a class that is not on the class path in CLASS_FILES. */
+    private static final byte[] NO_CLASS = new byte[0];
+    /** Rewritten class files, indexed by class name. */
+    private static final ConcurrentHashMap<String, byte[]> CLASS_FILES =
+        new ConcurrentHashMap<>();
+
+    /** Exit code passed to exit in the current run, or null. */
+    private static volatile Integer _exitCode;
+
+    /** Name of the class whose main method is run. */
+    private final String _className;
+    /** True iff the standard error is merged with the standard output. */
+    private final boolean _merge;
+    /** The class path used by run loaders. */
+    private final URL[] _classPath;
+    /** Loader for the next run. */
+    private RunLoader _loader;
+    /** Results of the last run. */
+    private ByteArrayOutputStream _out, _err;
+    /** Exit code of the last run. */
+    private int _code;
+    /** True iff the last run left threads running. */
+    private boolean _lingering;
+}
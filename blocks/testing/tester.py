@@ -9,6 +9,8 @@ from os.path import join
 
 PROGRAM = "java -ea blocks.Main --testing --no-display"
 
+CACHE_DIR = ".tester-cache"
+
 os.environ.pop('DISPLAY', None)
 
 def compare_boards(received, expected_pattern):
@@ -25,12 +27,98 @@ def compare_boards(received, expected_pattern):
         if actual_board != std_board:
             return f"Board #{cnt} does not match standard"
     return True
+
+class BoardChecker:
+    """Checks output text, delivered a piece at a time, against the boards
+    in EXPECTED_PATTERN as compare_boards does, for streaming comparison.
+    Only the current line and board are kept."""
+
+    def __init__(self, expected_pattern):
+        self._expected = re.findall(r'(?ms)^\*?\*?B\[.*?\]', expected_pattern)
+        self._max_board = max(map(len, self._expected), default=0)
+        self._count = 0
+        self._line = ""
+        self._board = None
+        self._overlong = False
+        self._skipping = False
+
+    def feed(self, text):
+        """Check the next piece, TEXT, of the output, returning None if it
+        is consistent with the expected boards so far, and otherwise a
+        message describing the problem."""
+        self._line += text
+        while True:
+            if self._skipping:
+                end = self._line.find("\n")
+                if end == -1:
+                    self._line = ""
+                    return None
+                self._line = self._line[end + 1:]
+                self._skipping = False
+            end = self._line.find("\n")
+            if end == -1:
+                break
+            line, self._line = self._line[:end + 1], self._line[end + 1:]
+            problem = self._check_line(line)
+            if problem:
+                return problem
+        in_board = self._board is not None or self._line.startswith("B[")
+        end = self._line.find("]")
+        if in_board and end != -1:
+            line, self._line = self._line[:end + 1], ""
+            self._skipping = True
+            return self._check_line(line)
+        elif in_board:
+            self._check_line(self._line)
+            self._line = ""
+        else:
+            self._skipping = not "B[".startswith(self._line[:2])
+        return None
+
+    def finish(self):
+        """Return None if the output fed so far has exactly the expected
+        boards, and otherwise a message describing the problem."""
+        problem = not self._skipping and self._check_line(self._line)
+        if problem:
+            return problem
+        if self._count != len(self._expected):
+            return "There are {} output boards; expected {}."\
+                   .format(self._count, len(self._expected))
+        return None
+
+    def _check_line(self, line):
+        if self._board is None:
+            if not line.startswith("B["):
+                return None
+            self._board, line = "B[", line[2:]
+        end = line.find("]")
+        if end == -1:
+            self._board += line
+            if len(self._board) > self._max_board:
+                self._board, self._overlong = "B[", True
+            return None
+        board, self._board = self._board + line[:end + 1], None
+        overlong, self._overlong = self._overlong, False
+        self._count += 1
+        if self._count > len(self._expected):
+            return "There are more than {} output boards."\
+                   .format(len(self._expected))
+        if overlong or board != self._expected[self._count - 1]:
+            return f"Board #{self._count} does not match standard"
+        return None
                            
 class Proj0_Tester(Tester):
     def output_filter(self, id, text):
         text = re.sub(r'#.*\r?\n','',text)
         return text
 
+    def stream_checker(self, testid):
+        standard = self.standard_output_file(testid)
+        if not standard:
+            return None
+        return BoardChecker(self.expected_output(testid, standard,
+                                                 self.output_filter))
+
     def output_compare(self, testid):
         standard = self.standard_output_file(testid)
         if self.rc != 0:
@@ -38,9 +126,13 @@ class Proj0_Tester(Tester):
                               .format(interpret_problem(self.rc, self.stderr))
             return
         elif self.stdout is not None and standard:
-            self.reason = compare_boards(self.output_filter(testid, self.stdout),
-                                        self.output_filter(testid,
-                                                           contents(standard)))
+            if self.streamed is not None:
+                self.reason = self.streamed
+            else:
+                self.reason = \
+                    compare_boards(self.output_filter(testid, self.stdout),
+                                   self.expected_output(testid, standard,
+                                                        self.output_filter))
             if self.reason is not True:
                 return
         if self.stderr:
@@ -49,20 +141,88 @@ class Proj0_Tester(Tester):
             self.reason = True
 
 show=None
+jobs=1
+backend='process'
+stream=False
+stats=False
+use_cache=True
+reorder=True
+bench_runs=0
+bench_output=bench_baseline=None
+bench_threshold=0.1
+shard=None
+merge=False
+diff_context=3
+json_report=junit_report=None
 try:
-    opts, args = getopt.getopt(sys.argv[1:], '', ['show='])
+    opts, args = getopt.getopt(sys.argv[1:], 'j:',
+                               ['show=', 'jobs=', 'jvm', 'stream',
+                                'stats', 'json=', 'junit=', 'no-cache',
+                                'in-order', 'bench=', 'bench-out=',
+                                'baseline=', 'threshold=', 'shard=',
+                                'merge', 'context=', 'full'])
     for opt, val in opts:
         if opt == '--show':
             show = int(val)
+        elif opt in ('-j', '--jobs'):
+            jobs = int(val)
+        elif opt == '--jvm':
+            backend = 'jvm'
+        elif opt == '--stream':
+            stream = True
+        elif opt == '--bench':
+            bench_runs = int(val)
+        elif opt == '--bench-out':
+            bench_output = val
+        elif opt == '--baseline':
+            bench_baseline = val
+        elif opt == '--threshold':
+            bench_threshold = float(val) / 100
+        elif opt == '--shard':
+            shard = tuple(map(int, val.split('/')))
+            if len(shard) != 2 or not 1 <= shard[0] <= shard[1]:
+                raise ValueError(val)
+        elif opt == '--merge':
+            merge = True
+        elif opt == '--context':
+            diff_context = int(val)
+        elif opt == '--full':
+            diff_context = None
+        elif opt == '--in-order':
+            reorder = False
+        elif opt == '--no-cache':
+            use_cache = False
+        elif opt == '--stats':
+            stats = True
+        elif opt == '--json':
+            json_report = val
+        elif opt == '--junit':
+            junit_report = val
         else:
             assert False
 except:
-    print("Usage: python3 tester.py [--show=N] TEST.in...",
+    print("Usage: python3 tester.py [--show=N] [-j N] [--jvm] [--stream] "
+          "[--stats] [--json=FILE] [--junit=FILE] "
+          "[--no-cache] [--in-order] [--bench=N] [--bench-out=FILE] "
+          "[--baseline=FILE] [--threshold=PERCENT] [--shard=I/N] "
+          "[--context=N] [--full] TEST.in...\n"
+          "       python3 tester.py --merge [--json=FILE] [--junit=FILE] "
+          "SHARD.json...",
           file=sys.stderr)
     sys.exit(1)
 
 tester = Proj0_Tester(tested_program=PROGRAM, report_limit=show,
-                      report_char_limit=10000)
+                      report_char_limit=10000, jobs=jobs, backend=backend,
+                      cache_dir=CACHE_DIR, stream_compare=stream,
+                      show_usage=stats, json_report=json_report,
+                      junit_report=junit_report,
+                      result_cache=use_cache, reorder=reorder,
+                      bench_runs=bench_runs, bench_output=bench_output,
+                      bench_baseline=bench_baseline,
+                      bench_threshold=bench_threshold, shard=shard,
+                      diff_context=diff_context)
 
+if merge:
+    sys.exit(0 if tester.merge_reports(args) else 1)
 sys.exit(0 if tester.test_all(args) else 1)
 
@@ -64,6 +64,48 @@ keyword parameters that you may pass to the constructor for Tester:
          [default: no limit]
     * report_char_limit: Limit on the number of characters reported for each
          file reported as a result of an erroneous test. [default: 1000].
+    * jobs: Number of tests to run concurrently.  0 means one per CPU.
+         Results are still reported in the order the tests are given.
+         [default: 1]
+    * backend: How run_program runs the tested program: 'process' (a new
+         process for each test) or 'jvm' (see JVM BACKEND, below).
+         [default: 'process']
+    * cache_dir: Directory in which to keep information that persists from
+         one run to the next, such as filtered expected outputs (see
+         expected_output).  None means keep nothing. [default: None]
+    * stream_compare: If true, check the standard output while the program
+         runs (see STREAMING COMPARISON, below). [default: False]
+    * stream_window: Number of final lines of standard output kept for
+         reports when stream_compare is true. [default: 50]
+    * show_usage: If true, print a table of the resources used by each
+         test after the summary. [default: False]
+    * json_report: If not None, the name of a file to which to write the
+         results and resource usage of all tests as JSON. [default: None]
+    * junit_report: If not None, the name of a file to which to write the
+         results and resource usage of all tests as JUnit XML.
+         [default: None]
+    * result_cache: If true (and cache_dir is not None), skip any test whose
+         inputs, expected outputs, and program are unchanged since it last
+         passed, reporting it as passed (see RESULT CACHE). [default: False]
+    * reorder: If true (and cache_dir is not None), run the tests in the
+         order given by P.schedule (see SCHEDULING) rather than the order
+         given to test_all. [default: False]
+    * bench_runs: If positive, the number of timed runs of each passing
+         test in benchmark mode (see BENCHMARKING). [default: 0]
+    * bench_output: If not None, the name of a file to which to write the
+         benchmark statistics (as a baseline for later runs). [default: None]
+    * bench_baseline: If not None, the name of a file written by an earlier
+         benchmark run against which to compare this one. [default: None]
+    * bench_threshold: The fraction by which a test's median time may
+         exceed its baseline before it counts as a regression.
+         [default: 0.1]
+    * diff_context: If not None, the number of lines of context in the
+         difference reports that replace the listings of outputs and
+         expected outputs in failure reports (see REPORTING).
+         [default: None]
+    * shard: If not None, a pair (I, N) indicating that test_all is to run
+         only the Ith (numbering from 1) of N disjoint parts of its tests
+         (see SHARDING). [default: None]
 
 Second, you may override several methods to affect the test procedure.
 For a tester P, the actual test performed for a test that is
@@ -74,17 +116,32 @@ designated by T is as follows:
     <report result>
     P.cleanup(T)
 
+When jobs is not 1, run_program and output_compare for different tests
+are performed concurrently, each on a separate shallow copy of P (so
+that overridings may freely set attributes of self); reporting and
+cleanup are done afterwards, one test at a time, in the original order.
+
 By default, the run_program method acts as follows:
 
-    1. Run the command <tested_program> P.command_args(T) (as a shell command),
-       with the empty string as the standard input, first using ulimit to
-       set the time limit, output limit, and VM limit.
+    1. Run the command P.command_argv(T) directly (without a shell), with
+       its standard input taken from the file P.command_stdin(T) (or empty,
+       if that is None), and with the resource limits P.resource_limits(T)
+       (by default, the time limit, output limit, and VM limit).
     2. Set P.stdout and P.stderr, respectively, to the standard output and
        standard error of the program.
     3. Set P.rc to the Unix exit status of the program.
+    4. Set P.usage to a dictionary describing the resources the program
+       used (see RESOURCE USAGE, below).
+
+You can override the command_argv, command_stdin, and resource_limits
+methods as desired.  By default, command_argv returns the words of
+tested_program, and command_stdin returns P.standard_input_file(T).
 
-You can override the command_args method as desired.  By default, it returns
-the string
+On Windows, or if a subclass overrides command_args (but not command_argv),
+run_program instead runs the shell command
+     <tested_program> P.command_args(T)
+(using ulimit to set the limits where available) and records only the
+elapsed time of each test.  By default, command_args returns the string
      < P.standard_input_file(T)
 
 The standard_input_file method is also overridable, and defaults to
@@ -103,11 +160,123 @@ comparison, it filters P.stdout and P.standard_output_file(T) through
 P.output_filter (the identity function by default, and P.stderr and
 P.standard_error_file(T) through P.error_filter (the identity by
 default).  You can override the standard_output_file,
-standard_error_file, output_filter, and error_filter methods.
+standard_error_file, output_filter, and error_filter methods.  The
+filtered expected outputs come from P.expected_output, which filters each
+file only once and caches the result (in cache_dir, if set) until the
+file or the filter changes.
                                                               
 The cleanup method is provided in case a test produces output files
 that should be removed.  By default, it does nothing.
 
+RESOURCE USAGE
+==============
+
+For each test, run_program sets P.usage to a dictionary with the keys
+    wall     Elapsed time (seconds).
+    user     User CPU time (seconds).
+    sys      System CPU time (seconds).
+    maxrss   Maximum resident set size (Kbytes).
+    minflt   Minor page faults.
+    majflt   Major page faults.
+All but wall come from os.wait4 on the tested program, and so include the
+usage of any of its descendants that it waited for; they are absent where
+that is unavailable (on Windows, with the jvm backend).  After all tests
+are run, the results are also available as P.results, a list with one
+dictionary per test, in the order tested, containing the test's id, its
+outcome ('passed' or 'failed'), the reason for any failure, the tested
+program, and its usage.  The parameters show_usage, json_report, and
+junit_report print these as a table after the summary, and write them as
+JSON and JUnit XML, respectively.
+
+STREAMING COMPARISON
+====================
+
+With stream_compare=True, run_program does not collect the whole standard
+output before comparing it.  Instead, it feeds each line, as filtered by
+P.output_filter, to the checker returned by P.stream_checker(T) as the
+line arrives.  At the first divergence, it kills the program and sets
+P.reason to a message giving the line and byte offset of the offending
+line, so that output_compare is skipped.  Only the last stream_window
+lines of output (and a bounded amount of error output) are kept for the
+report, so memory use does not grow with the output.  This is only valid
+when output_filter converts each line independently of the others, as
+line-by-line substitutions do.  The default checker compares against
+P.expected_output for P.standard_output_file(T); overridings of
+stream_checker may return other checkers (see ExactChecker) or None,
+which means to run the test without streaming.
+
+RESULT CACHE
+============
+
+When result_cache is true, each test T has a key: a hash of the
+contents of the files P.input_files(T), P.standard_output_files(T), and
+P.standard_error_files(T), of tested_program, and of the files
+P.program_files().  By default, the latter are the .class and .jar files
+on the class path of the tested program (the -cp option of a java
+command, or else $CLASSPATH), any files named in tested_program, and
+the source files of the testing module and of P's class.  Whenever T
+passes, its key is recorded in cache_dir, and later runs in which T has
+the same key report it as passed without running it.  Only passes are
+recorded, so failing tests are always rerun.
+
+SCHEDULING
+==========
+
+When cache_dir is not None, each run records the elapsed time and
+outcome of every test it runs in cache_dir.  If reorder is true, test_all
+then runs its tests in the order returned by P.schedule(TESTS), which by
+default puts the tests that failed on their most recent run first,
+followed by the tests with no history, followed by the rest, each group
+(but the second) longest first (so that with jobs > 1, long tests do not
+start last).  Ties keep their order in TESTS, so that with no history,
+the order is unchanged.
+Tests are reported in the order they are run.
+
+SHARDING
+========
+
+When shard is (I, N), test_all divides its tests into N parts using
+the durations recorded in cache_dir (see SCHEDULING), assigning the
+tests, longest first, each to the part with the least total duration so
+far (tests with no recorded duration count as the average of the
+others).  The division depends only on the test names and the recorded
+durations, so runs on different machines that share the same history
+(or that have none) divide the tests identically, and together run each
+test exactly once.  To keep the history the same for all parts, runs
+of a part do not record durations.  Instead, write each part's results
+with json_report and pass the resulting files to P.merge_reports, which
+reports the totals just as test_all does and records the durations and
+outcomes of all the tests in cache_dir.
+
+BENCHMARKING
+============
+
+If bench_runs is N > 0, then after testing as usual, test_all runs each
+test that passed once more as a warm-up, and then N more times, one at a
+time, timing each call to P.run_program (the comparison against expected
+output is not repeated).  It reports the minimum, median, 95th
+percentile, and standard deviation of the wall-clock time and of the CPU
+time (user plus system; see RESOURCE USAGE) of each test, and writes
+them as JSON to bench_output, if that is not None.  If bench_baseline is
+the name of such a file, any test whose median wall or CPU time exceeds
+its median in that baseline by more than a fraction bench_threshold is
+reported as a regression, and test_all returns false.
+
+JVM BACKEND
+===========
+
+When tested_program has the form 'java OPTIONS CLASS ARGS', the parameter
+backend='jvm' avoids starting a new JVM for every test.  Instead,
+run_program hands each test to a JvmPool, which keeps long-lived JVMs
+running MainServer (compiled from MainServer.java in this directory on
+first use).  For each test, MainServer calls CLASS.main(ARGS) in a fresh
+class loader (so that static state does not carry over between tests),
+with the contents of P.standard_input_file(T) as its standard input,
+capturing its standard output and standard error, and turning any call of
+System.exit into the test's exit code.  The time limit applies to each
+test; a JVM that exceeds it or dies is killed and replaced.  The other
+ulimits and command_args are not used by this backend.
+
 
 REPORTING
 =========
@@ -136,14 +305,50 @@ For a testing object P, and test T, the methods are
     * P.standard_error_files(T): The standard (correct) error files.
         By default, one entry containing the default value of
         standard_error_file.
+
+If diff_context is not None, then when the output files of a failing test
+correspond one-to-one with its standard output files (and likewise for
+error files), the report shows, instead of their contents, only the first
+place where each output differs from its standard output, as a unified
+diff hunk with diff_context lines of context.  Lines are compared after
+applying .output_filter (or .error_filter) to each line separately and
+removing trailing whitespace; lines that the filter removes entirely are
+ignored.  The files are read a line at a time up to the first difference,
+and only the next DIFF_WINDOW lines of each are examined to find the end
+of the hunk, so that the report takes little time or space even for very
+large outputs.  Outputs checked by streaming comparison are always listed
+in full (see STREAMING COMPARISON).
 """
 
 
 import sys, re
 import platform
-from subprocess import Popen, PIPE
-from os.path import splitext, basename, dirname, join, exists
+import shlex, struct, atexit, json, marshal, hashlib
+import os
+import statistics
+from time import monotonic
+from xml.etree import ElementTree
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired, check_call
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Timer, Thread
+from collections import deque
+from itertools import islice
+from contextlib import contextmanager
+from difflib import SequenceMatcher
+from io import BytesIO, StringIO, TextIOWrapper, IncrementalNewlineDecoder
+from codecs import getincrementaldecoder
+from locale import getpreferredencoding
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import cpu_count, environ, pathsep, stat, makedirs, replace
+from os.path import splitext, basename, dirname, join, exists, abspath, \
+    isdir, isfile
+from glob import glob
 from signal import *
+try:
+    import resource
+except ImportError:
+    resource = None
 
 def contents(filename):
     """The contents of FILENAME, or the empty string if the file does not
@@ -154,6 +359,89 @@ def contents(filename):
     except:
         return ''
 
+# SHA-1 digests of the source files of filters, by file name, each
+# computed at most once per run.
+source_digests = {}
+
+def source_digest(filename):
+    """The SHA-1 digest of the contents of file FILENAME, or the empty
+    string if it is unreadable."""
+    if filename not in source_digests:
+        try:
+            with open(filename, 'rb') as inp:
+                source_digests[filename] = hashlib.sha1(inp.read()).hexdigest()
+        except OSError:
+            source_digests[filename] = ''
+    return source_digests[filename]
+
+def filter_key(filter):
+    """A string identifying the function or method FILTER, which changes
+    whenever its code, its default argument values, the values of the
+    variables it refers to from enclosing functions, or the source file
+    that defines it (and so any helper functions there) does."""
+    func = getattr(filter, '__func__', filter)
+    digest = hashlib.sha1(marshal.dumps(func.__code__))
+    digest.update(repr((func.__defaults__, func.__kwdefaults__)).encode())
+    for cell in func.__closure__ or ():
+        try:
+            digest.update(repr(cell.cell_contents).encode())
+        except ValueError:
+            digest.update(b"<empty>")
+    return "{}:{}:{}".format(func.__qualname__, digest.hexdigest(),
+                             source_digest(func.__code__.co_filename))
+
+def load_cache(cache_dir, name):
+    """The dictionary stored in file NAME in directory CACHE_DIR, or an
+    empty dictionary if CACHE_DIR is None or the file is missing or
+    unreadable."""
+    if cache_dir is None:
+        return {}
+    try:
+        with open(join(cache_dir, name)) as inp:
+            data = json.load(inp)
+        return data if type(data) is dict else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache_dir, name, data):
+    """Store the dictionary DATA in file NAME in directory CACHE_DIR
+    (creating the directory if necessary), unless CACHE_DIR is None."""
+    if cache_dir is None:
+        return
+    makedirs(cache_dir, exist_ok=True)
+    tmp = join(cache_dir, name + ".tmp")
+    with open(tmp, "w") as out:
+        json.dump(data, out)
+    replace(tmp, join(cache_dir, name))
+
+def file_digest(filename):
+    """The SHA-256 hash (in hex) of the contents of file FILENAME, or
+    None if it cannot be read."""
+    digest = hashlib.sha256()
+    try:
+        with open(filename, "rb") as inp:
+            for chunk in iter(lambda: inp.read(STREAM_CHUNK), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+def classpath_files(classpath):
+    """The sorted list of .class and .jar files on the Java class path
+    CLASSPATH."""
+    files = set()
+    for entry in classpath.split(pathsep):
+        if entry.endswith("*"):
+            files.update(glob(entry[:-1] + "*.jar"))
+        elif isdir(entry):
+            for dir, subdirs, names in os.walk(entry):
+                subdirs[:] = [ d for d in subdirs if not d.startswith(".") ]
+                files.update(join(dir, name) for name in names
+                             if name.endswith((".class", ".jar")))
+        elif isfile(entry):
+            files.add(entry)
+    return sorted(abspath(f) for f in files)
+
 def interpret_problem(rc, error_output):
     if rc == 1:
         mat = re.search(r'(?m)^Exception in thread ".*" (.*)\s*(at .*)',
@@ -187,13 +475,71 @@ DEFAULT_PARAMS = {
          'heap_size_limit' : 500000, # KB
          'report_limit' : None,
          'report_char_limit' : 1000,
+    'jobs' : 1,
+    'backend' : 'process',
+    'cache_dir' : None,
+    'stream_compare' : False,
+    'stream_window' : 50,
+    'show_usage' : False,
+    'json_report' : None,
+    'junit_report' : None,
+    'result_cache' : False,
+    'reorder' : False,
+    'bench_runs' : 0,
+    'bench_output' : None,
+    'bench_baseline' : None,
+    'bench_threshold' : 0.1,
+    'shard' : None,
+    'diff_context' : None,
 }        
 
+# Size of the pieces in which streamed output is read.  Lines longer than
+# this are checked a piece at a time.
+STREAM_CHUNK = 1 << 16
+# Limit on the amount of standard error kept when streaming.
+STREAM_ERROR_LIMIT = 1 << 20
+# Number of lines after the first difference examined by difference reports.
+DIFF_WINDOW = 200
+# Units of ru_maxrss per Kbyte.
+MAXRSS_PER_KB = 1024 if platform.system() == "Darwin" else 1
+
+class ExactChecker:
+    """Checks a stream of output text, delivered in pieces, against the
+    text EXPECTED."""
+
+    def __init__(self, expected):
+        self._expected = expected
+        self._pos = 0
+
+    def feed(self, text):
+        """Check the next piece, TEXT, of the output, returning None if it
+        is consistent with the expected text so far, and otherwise a message
+        describing the problem."""
+        end = self._pos + len(text)
+        if self._expected[self._pos:end] != text:
+            return "Output does not match expected output"
+        self._pos = end
+        return None
+
+    def finish(self):
+        """Return None if the output fed so far is complete, and otherwise
+        a message describing the problem."""
+        if self._pos != len(self._expected):
+            return "Output ends before expected output"
+        return None
+
 class Tester:
 
     def __init__(self, **params):
         self.params = DEFAULT_PARAMS.copy()
         self.params.update(params)
+        self._expected = None
+        self._expected_used = set()
+        self._expected_lock = Lock()
+        self._results_cache = None
+        self._results_passed = set()
+        self._program_digest = None
+        self._history = None
         self.clear()
 
     def __getattr__(self, name):
@@ -205,6 +551,9 @@ class Tester:
     def clear(self):
         self.passed = self.count = 0
         self.files_shown = set()
+        self.jvm_pool = None
+        self.results = []
+        self.bench = {}
 
     @property
     def failed(self):
@@ -212,9 +561,44 @@ class Tester:
 
     def test_all(self, tests):
         self.clear()
-        for id in tests:
-            self._perform_test(id)
+        with self._expected_lock:
+            if self._expected is None:
+                self._expected = load_cache(self.cache_dir, "expected.json")
+        if self.result_cache and self.cache_dir is not None:
+            self._results_cache = load_cache(self.cache_dir, "results.json")
+            self._results_passed = set()
+            self._program_digest = self._digest_program()
+        self._history = load_cache(self.cache_dir, "history.json")
+        if self.shard:
+            tests = self.shard_tests(tests, *self.shard)
+        if self.reorder:
+            tests = self.schedule(tests)
+        if self.backend == 'jvm':
+            self.jvm_pool = JvmPool(self.tested_program)
+        try:
+            if self.jobs == 1:
+                for id in tests:
+                    self._perform_test(id)
+            else:
+                self._perform_concurrent_tests(tests)
+            if self.bench_runs > 0:
+                self._benchmark([ result['id'] for result in self.results
+                                  if result['outcome'] == 'passed' ])
+        finally:
+            if self.jvm_pool:
+                self.jvm_pool.close()
+            self._save_expected()
+            self._save_results()
+            self._save_history()
         self._report_summary()
+        if self.show_usage:
+            self._report_usage()
+        if self.json_report:
+            self._write_json_report(self.json_report)
+        if self.junit_report:
+            self._write_junit_report(self.junit_report)
+        if self.bench_runs > 0:
+            return self._report_bench() and self.passed == self.count
         return self.passed == self.count
 
     def base_id(self, id):
@@ -319,29 +703,270 @@ class Tester:
 
     def run_program(self, id):
         """Run the test program for test ID, placing the standard output in
-        SELF.stdout the standard error output in SELF.stderr, and the return
-        code in SELF.rc. By default, runs SELF._command_line(ID), pipes
-        the results to SELF.stdout and SELF.stderr, and places the return code
-        in SELF.rc.  Overridings may set .stdout or .stderr to None, indicating
-        that they are irrelevant."""
-        proc = Popen(self._command_line(id),
-                     shell=True, universal_newlines=True, 
-                     stdout=PIPE, stderr=PIPE, stdin=PIPE)
-        self.stdout, self.stderr = proc.communicate('')
+        SELF.stdout the standard error output in SELF.stderr, the return
+        code in SELF.rc, and its resource usage in SELF.usage. By default,
+        runs SELF.command_argv(ID) as described in the module documentation,
+        pipes the results to SELF.stdout and SELF.stderr, and places the
+        return code in SELF.rc.  Overridings may set .stdout or .stderr to
+        None, indicating that they are irrelevant.  With the 'jvm' backend,
+        runs the test in SELF.jvm_pool instead."""
+        start = monotonic()
+        try:
+            self._run_program(id)
+        finally:
+            self.usage = dict(self.usage or {}, wall=monotonic() - start)
+
+    def _run_program(self, id):
+        if self.jvm_pool:
+            input_file = self.standard_input_file(id)
+            stdin = b""
+            if input_file:
+                with open(input_file, "rb") as inp:
+                    stdin = inp.read()
+            self.rc, stdout, stderr = \
+                self.jvm_pool.run(stdin, timeout=self.time_limit)
+            self.stdout, self.stderr = \
+                decode_output(stdout), decode_output(stderr)
+            return
+        if self.stream_compare:
+            checker = self.stream_checker(id)
+            if checker is not None:
+                self._run_streaming(id, checker)
+                return
+        if self._uses_shell():
+            proc = Popen(self._command_line(id),
+                         shell=True, universal_newlines=True,
+                         stdout=PIPE, stderr=PIPE, stdin=PIPE)
+            self.stdout, self.stderr = proc.communicate('')
+            self.rc = proc.returncode
+            return
+        proc = self._start_program(id)
+        errors = []
+        error_reader = Thread(target=_read_limited,
+                              args=(proc.stderr, None, errors))
+        error_reader.start()
+        with proc.stdout:
+            stdout = proc.stdout.read()
+        error_reader.join()
+        self.usage = wait_for_usage(proc)
         self.rc = proc.returncode
+        self.stdout = decode_output(stdout)
+        self.stderr = decode_output(b"".join(errors))
+
+    def _uses_shell(self):
+        """True iff the tested program must be run by a shell command."""
+        return platform.system() == "Windows" \
+            or (type(self).command_args is not Tester.command_args
+                and type(self).command_argv is Tester.command_argv)
+
+    def _start_program(self, id):
+        """Start the tested program for test ID as specified by
+        .command_argv, .command_stdin, and .resource_limits, without a
+        shell, returning the Popen for it, with its standard output and
+        error piped in binary mode."""
+        limits = self.resource_limits(id) if resource else ()
+        input_file = self.command_stdin(id)
+        stdin = open(input_file, "rb") if input_file else DEVNULL
+        prlimit = hasattr(resource, "prlimit")
+        try:
+            proc = Popen(self.command_argv(id), stdin=stdin,
+                         stdout=PIPE, stderr=PIPE,
+                         preexec_fn=None if prlimit or not limits
+                                    else lambda: _set_limits(limits))
+        finally:
+            if input_file:
+                stdin.close()
+        if prlimit:
+            _set_limits(limits, proc.pid)
+        return proc
+
+    def stream_checker(self, id):
+        """A checker for the standard output of test ID, used when
+        stream_compare is true, or None if there is nothing to check.
+        A checker has methods feed(TEXT) and finish(), as for ExactChecker.
+        By default, an ExactChecker for the filtered contents of
+        .standard_output_file(ID), if it exists."""
+        expected = self.expected_output(id, self.standard_output_file(id),
+                                        self.output_filter) \
+                   if self.standard_output_file(id) else None
+        return None if expected is None else ExactChecker(expected)
+
+    def _run_streaming(self, id, checker):
+        """Run the test program for test ID as for run_program, feeding
+        each line of its standard output (filtered by .output_filter) to
+        CHECKER as it arrives.  On the first divergence, kill the program
+        and set .reason and .streamed to a description of the divergence.
+        Otherwise, set .streamed to True if the whole output checks, and to
+        CHECKER's message if not.  Keeps only the last .stream_window lines
+        of the output in .stdout."""
+        proc = self._start_program(id)
+        errors = []
+        error_reader = Thread(target=_read_limited,
+                              args=(proc.stderr, STREAM_ERROR_LIMIT, errors))
+        error_reader.start()
+        decoder = IncrementalNewlineDecoder(
+            getincrementaldecoder(getpreferredencoding(False))("replace"),
+            translate=True)
+        window = deque(maxlen=self.stream_window)
+        pieces = lines = offset = 0
+        with proc.stdout:
+            for raw in iter(lambda: proc.stdout.readline(STREAM_CHUNK), b""):
+                line = decoder.decode(raw)
+                window.append(line)
+                pieces += 1
+                problem = checker.feed(self.output_filter(id, line))
+                if problem:
+                    proc.kill()
+                    self.reason = self.streamed = \
+                        "{} at line {} (byte {})" \
+                        .format(problem, lines + 1, offset)
+                    break
+                offset += len(raw)
+                lines += raw.endswith(b"\n")
+            else:
+                line = decoder.decode(b"", final=True)
+                problem = line and checker.feed(self.output_filter(id, line))
+                self.streamed = problem or checker.finish() or True
+                if line:
+                    window.append(line)
+                    pieces += 1
+        error_reader.join()
+        self.usage = wait_for_usage(proc)
+        self.rc = proc.returncode
+        self.stderr = decode_output(b"".join(errors))
+        skipped = pieces - len(window)
+        self.stdout = ("[... {} earlier lines not shown ...]\n"
+                       .format(skipped) if skipped > 0 else "") \
+                      + "".join(window)
 
     def _perform_test(self, id):
+        self._run_test(id)
+        self._record_result(id)
+
+    def _run_test(self, id):
+        """Run test ID and set .reason to its result.  A .reason set by
+        run_program (as for streaming comparison) takes precedence over
+        output_compare."""
         self.reason = None
-        self.count += 1
+        self.streamed = None
+        self.usage = None
+        self.cached = False
+        self.key = None
+        if self._results_cache is not None:
+            self.key = self.result_key(id)
+            if self.key in self._results_cache:
+                self.cached = self.reason = True
+                return
         self.run_program(id)
-        self.output_compare(id)
+        if self.reason is None:
+            self.output_compare(id)
+
+    def _record_result(self, id):
+        """Count and report the result of test ID, as set by _run_test, and
+        clean up after it."""
+        self.count += 1
+        self.results.append({ 'id': id, 'program': self.tested_program,
+                              'outcome': ('passed' if self.reason is True
+                                          else 'failed'),
+                              'reason': (None if self.reason is True
+                                         else self.reason),
+                              'usage': self.usage or {},
+                              'cached': self.cached })
         if self.reason is True:
+            if self.key is not None:
+                self._results_cache[self.key] = abspath(id)
+                self._results_passed.add(self.key)
             self.passed += 1
             self._report_pass(id)
         else:
             self._report_fail(id)
         self.cleanup(id)
 
+    def schedule(self, tests):
+        """The list TESTS, reordered as described under SCHEDULING."""
+        def key(id):
+            entry = self._history.get(abspath(id))
+            if not isinstance(entry, dict):
+                return (1, 0)
+            else:
+                return (0 if entry.get('failed') else 2,
+                        -entry.get('duration', 0))
+        return sorted(tests, key=key)
+
+    def shard_tests(self, tests, index, count):
+        """The INDEXth (numbering from 1) of COUNT disjoint parts of TESTS,
+        as described under SHARDING, in the order of TESTS."""
+        return shard_tests(tests, index, count,
+                           lambda id: (self._history.get(abspath(id)) or {})
+                                      .get('duration'))
+
+    def merge_reports(self, filenames):
+        """Combine the results in the JSON reports FILENAMES (as written
+        by json_report) as if from a single run, reporting a summary and
+        writing json_report and junit_report as for test_all.  Returns
+        true iff all the tests passed."""
+        self.clear()
+        for filename in filenames:
+            with open(filename) as inp:
+                report = json.load(inp)
+            self.count += report['tests']
+            self.passed += report['passed']
+            self.results += report['results']
+        self._history = load_cache(self.cache_dir, "history.json")
+        self._save_history()
+        self._report_summary()
+        if self.show_usage:
+            self._report_usage()
+        if self.json_report:
+            self._write_json_report(self.json_report)
+        if self.junit_report:
+            self._write_junit_report(self.junit_report)
+        return self.passed == self.count
+
+    def _save_history(self):
+        """Save the durations and outcomes of the tests just run in
+        cache_dir, as used by .schedule.  Cached results leave the
+        recorded duration unchanged."""
+        if self.cache_dir is None or self._history is None or self.shard:
+            return
+        for result in self.results:
+            path = abspath(result['id'])
+            entry = self._history.get(path)
+            entry = dict(entry) if isinstance(entry, dict) else {}
+            entry['failed'] = result['outcome'] != 'passed'
+            if 'wall' in result['usage']:
+                entry['duration'] = round(result['usage']['wall'], 3)
+            self._history[path] = entry
+        try:
+            save_cache(self.cache_dir, "history.json", self._history)
+        except OSError:
+            pass
+
+    def _fork(self):
+        """A shallow copy of this Tester.  The copy shares .params and
+        .files_shown with the original."""
+        copy = object.__new__(type(self))
+        copy.__dict__.update(self.__dict__)
+        return copy
+
+    def _perform_concurrent_tests(self, tests):
+        """Run TESTS in a pool of .jobs threads, each test on its own fork
+        of this Tester.  Results are recorded in the order of TESTS as they
+        become available, so that report_limit and files_shown behave just
+        as for sequential testing."""
+        def run(id):
+            test = self._fork()
+            test._run_test(id)
+            return test
+
+        with ThreadPoolExecutor(max_workers=self.jobs or cpu_count()) as pool:
+            futures = [ (id, pool.submit(run, id)) for id in tests ]
+            for id, future in futures:
+                test = future.result()
+                test.count, test.passed = self.count, self.passed
+                test._record_result(id)
+                self.count, self.passed = test.count, test.passed
+
     def command_args(self, testid):
         """The default command-line arguments that follow the shell syntax
         to invoke the tested program.  The default is simply a redirect of
@@ -349,6 +974,30 @@ class Tester:
         .standard_input_file."""
         return " <" + self.standard_input_file(testid) + " "
 
+    def command_argv(self, testid):
+        """The list of words of the command that runs the tested program
+        for TESTID (without a shell).  The default is the words of
+        tested_program, split as by a shell."""
+        return shlex.split(self.tested_program)
+
+    def command_stdin(self, testid):
+        """The name of the file to use as the standard input of the tested
+        program for TESTID, or None for an empty input.  The default is
+        .standard_input_file(TESTID)."""
+        return self.standard_input_file(testid)
+
+    def resource_limits(self, testid):
+        """A list of pairs (RESOURCE, LIMIT), as for resource.setrlimit, to
+        impose on the tested program for TESTID.  The default limits CPU
+        time to time_limit, output file size to file_size_limit, and data
+        size to heap_size_limit (except on macOS, where it imposes no
+        limits)."""
+        if platform.system() == "Darwin":
+            return []
+        return [ (resource.RLIMIT_CPU, self.time_limit),
+                 (resource.RLIMIT_FSIZE, self.file_size_limit * 512),
+                 (resource.RLIMIT_DATA, self.heap_size_limit * 1024) ]
+
     def _command_line(self, id):
         if platform.system() == "Windows" or platform.system() == "Darwin":
             command_fmt = "{command} {args}"
@@ -382,19 +1031,118 @@ class Tester:
         if self.rc != 0:
             self.reason = "Program exited abnormally: {}" \
                               .format(interpret_problem(self.rc, self.stderr))
-        elif self.stdout is not None and self.standard_output_file(testid) \
+        elif self.streamed not in (None, True):
+            self.reason = self.streamed + "."
+        elif self.streamed is None \
+                and self.stdout is not None and self.standard_output_file(testid) \
              and self.output_filter(testid, self.stdout) \
-                 != self.output_filter(testid,
-                                       contents(self.standard_output_file(testid))):
+                != self.expected_output(testid,
+                                        self.standard_output_file(testid),
+                                        self.output_filter):
             self.reason = "Output does not match expected output."
         elif self.stderr is not None and self.standard_error_file(testid) \
              and self.error_filter(testid, self.stderr) \
-                 != self.error_filter(testid,
-                                      contents(self.standard_error_file(testid))):
+                != self.expected_output(testid,
+                                        self.standard_error_file(testid),
+                                        self.error_filter):
             self.reason = "Error output does not match expected output."
         else:
             self.reason = True
     
+    def expected_output(self, id, filename, filter):
+        """The contents of FILENAME converted by FILTER (a method such as
+        .output_filter) for test ID, or None if FILENAME does not exist.
+        Each result is computed once and then cached, in memory and in
+        cache_dir, keyed by ID, the path and modification time of
+        FILENAME, and FILTER (as identified by filter_key)."""
+        try:
+            info = stat(filename)
+        except OSError:
+            return None
+        key = "\0".join((self.base_id(id), abspath(filename),
+                         str(info.st_mtime_ns), str(info.st_size),
+                         filter_key(filter)))
+        with self._expected_lock:
+            if self._expected is None:
+                self._expected = load_cache(self.cache_dir, "expected.json")
+            self._expected_used.add(key)
+            if key in self._expected:
+                return self._expected[key]
+        text = filter(id, contents(filename))
+        with self._expected_lock:
+            self._expected[key] = text
+        return text
+
+    def _save_expected(self):
+        """Save the cache of expected outputs in cache_dir, dropping the
+        entries for older versions of the files used in this run."""
+        with self._expected_lock:
+            if self._expected is None or self.cache_dir is None:
+                return
+            used = { key.split("\0")[1] for key in self._expected_used }
+            self._expected = \
+                { key: text for key, text in self._expected.items()
+                  if key in self._expected_used
+                     or key.split("\0")[1] not in used }
+            try:
+                save_cache(self.cache_dir, "expected.json", self._expected)
+            except OSError:
+                pass
+
+    def program_files(self):
+        """The files on which the behavior of the tested program and of
+        this Tester depend, for the purposes of result_cache (see RESULT
+        CACHE)."""
+        try:
+            classpath = parse_java_command(self.tested_program)[2] \
+                or environ.get("CLASSPATH", ".")
+        except ValueError:
+            classpath = environ.get("CLASSPATH", "")
+        files = classpath_files(classpath)
+        files += [ abspath(word) for word in shlex.split(self.tested_program)
+                   if isfile(word) ]
+        for cls in type(self).__mro__:
+            module = sys.modules.get(cls.__module__)
+            if getattr(module, "__file__", None):
+                files.append(abspath(module.__file__))
+        return list(dict.fromkeys(files))
+
+    def _digest_program(self):
+        digest = hashlib.sha256(self.tested_program.encode())
+        for filename in self.program_files():
+            digest.update("\0{}\0{}".format(filename, file_digest(filename))
+                          .encode())
+        return digest.hexdigest()
+
+    def result_key(self, id):
+        """The key identifying the inputs, expected outputs, and program
+        for test ID in the result cache (see RESULT CACHE)."""
+        digest = hashlib.sha256(self._program_digest.encode())
+        for files in (self.input_files(id), self.standard_output_files(id),
+                      self.standard_error_files(id)):
+            for name, filename, content in files:
+                digest.update("\0{}\0{}".format(
+                    name,
+                    file_digest(filename) if filename is not None
+                    else hashlib.sha256(content.encode()).hexdigest())
+                              .encode())
+            digest.update(b"\1")
+        return digest.hexdigest()
+
+    def _save_results(self):
+        """Save the result cache in cache_dir, dropping stale keys of the
+        tests in this run."""
+        if self._results_cache is None:
+            return
+        tested = { abspath(result['id']) for result in self.results }
+        try:
+            save_cache(self.cache_dir, "results.json",
+                       { key: id for key, id in self._results_cache.items()
+                         if id not in tested or key in self._results_passed })
+        except OSError:
+            pass
+        self._results_cache = None
+
     def output_filter(self, id, content):
         """A filter applied to the standard output before comparing with
         expected output for test ID."""
@@ -411,7 +1159,9 @@ class Tester:
         pass
 
     def _report_pass(self, id):
-        print("** {id} PASSED.".format(id=self.base_id(id)))
+        print("** {id} PASSED{cached}."
+              .format(id=self.base_id(id),
+                      cached=" (cached)" if self.cached else ""))
         sys.stdout.flush()
         
     def _report_fail(self, id):
@@ -427,14 +1177,22 @@ class Tester:
                   .format(limit=self.report_limit))
             print()
         if not suppress:
-            for title, name_pairs in (
-                ("**** INPUT FILES:", self.input_files(id)), 
-                ("**** OUTPUTS FROM TEST PROGRAM:", self.output_files(id)),
-                ("**** EXPECTED OUTPUTS:", self.standard_output_files(id)),
-                ("**** ERROR OUTPUTS FROM TEST PROGRAM:", self.error_files(id)),
-                ("**** EXPECTED ERROR OUTPUTS:", self.standard_error_files(id))):
-
-                self._print_report(title, name_pairs)
+            self._print_report("**** INPUT FILES:", self.input_files(id))
+            for kind, outputs, standards, filter in (
+                    ("OUTPUTS", self.output_files(id),
+                     self.standard_output_files(id), self.output_filter),
+                    ("ERROR OUTPUTS", self.error_files(id),
+                     self.standard_error_files(id), self.error_filter)):
+                if self.diff_context is not None and self.streamed is None \
+                   and outputs and len(outputs) == len(standards):
+                    self._print_differences(
+                        "**** DIFFERENCES FROM EXPECTED {}:".format(kind),
+                        id, outputs, standards, filter)
+                else:
+                    self._print_report(
+                        "**** {} FROM TEST PROGRAM:".format(kind), outputs)
+                    self._print_report("**** EXPECTED {}:".format(kind),
+                                       standards)
             print("** End of {id} error report **".format(id=base))
             print()
 
@@ -475,6 +1233,32 @@ class Tester:
                       .format(truncated))
             print("+" + "-" * 65 + "+")
 
+    def _print_differences(self, title, id, outputs, standards, filter):
+        """Print the first difference between each of the reportable files
+        OUTPUTS and the corresponding file in STANDARDS, comparing lines
+        converted by FILTER, as described under REPORTING."""
+        print()
+        print(title)
+        for output, standard in zip(outputs, standards):
+            name = "{} vs. {}".format(output[0], standard[0])
+            print("+--- " + name + " " + "-" * (60-len(name)) + "+")
+            with report_lines(id, standard, filter) as expected, \
+                 report_lines(id, output, filter) as actual:
+                hunk = first_difference(expected, actual, self.diff_context)
+            if hunk is None:
+                print("[no differences in lines compared]")
+            else:
+                print("--- {}\n+++ {}".format(standard[0], output[0]))
+                segment = "\n".join(hunk) + "\n"
+                limit = self.report_char_limit
+                if limit and len(segment) > limit:
+                    sys.stdout.write(segment[:limit] + "\n")
+                    print("... + {} more characters [listing truncated]"
+                          .format(len(segment) - limit))
+                else:
+                    sys.stdout.write(segment)
+            print("+" + "-" * 65 + "+")
+
     def _report_summary(self):
         print()
         if self.passed == self.count:
@@ -482,3 +1266,424 @@ class Tester:
         else:
             print("Passed {passed} out of {num} tests."
                   .format(passed=self.passed, num=self.count))
+
+    def _report_usage(self):
+        print()
+        print("{:<24} {:>6} {:>8} {:>8} {:>8} {:>9} {:>9}"
+              .format("Test", "Result", "Wall(s)", "User(s)", "Sys(s)",
+                      "MaxRSS(K)", "Faults"))
+        for result in self.results:
+            usage = result['usage']
+            def field(key, fmt="{:.2f}"):
+                return fmt.format(usage[key]) if key in usage else "-"
+            faults = "-" if 'minflt' not in usage \
+                else str(usage['minflt'] + usage['majflt'])
+            print("{:<24} {:>6} {:>8} {:>8} {:>8} {:>9} {:>9}"
+                  .format(self.base_id(result['id'])[:24],
+                          "PASS" if result['outcome'] == 'passed' else "FAIL",
+                          field('wall'), field('user'), field('sys'),
+                          field('maxrss', "{}"), faults))
+
+    def _write_json_report(self, filename):
+        with open(filename, "w") as out:
+            json.dump({ 'tests': self.count, 'passed': self.passed,
+                        'results': self.results }, out, indent=1)
+
+    def _write_junit_report(self, filename):
+        suite = ElementTree.Element(
+            "testsuite", name=self.tested_program or "tests",
+            tests=str(self.count), failures=str(self.count - self.passed),
+            time="{:.3f}".format(sum(r['usage'].get('wall', 0)
+                                     for r in self.results)))
+        for result in self.results:
+            case = ElementTree.SubElement(
+                suite, "testcase", name=self.base_id(result['id']),
+                classname=self.base_dir(result['id']) or ".",
+                time="{:.3f}".format(result['usage'].get('wall', 0)))
+            props = ElementTree.SubElement(case, "properties")
+            for key, value in sorted(result['usage'].items()):
+                ElementTree.SubElement(props, "property", name=key,
+                                       value=str(value))
+            if result['outcome'] != 'passed':
+                ElementTree.SubElement(case, "failure",
+                                       message=str(result['reason']))
+        ElementTree.ElementTree(suite).write(filename, encoding="utf-8",
+                                             xml_declaration=True)
+
+    def _benchmark(self, tests):
+        """Set .bench[ID] to the statistics for each test ID in TESTS, as
+        described under BENCHMARKING."""
+        print()
+        print("Benchmarking {} tests, {} runs each..."
+              .format(len(tests), self.bench_runs))
+        sys.stdout.flush()
+        for id in tests:
+            samples = { 'wall': [], 'cpu': [] }
+            for run in range(self.bench_runs + 1):
+                self.usage = None
+                self.run_program(id)
+                self.cleanup(id)
+                if run == 0:
+                    continue
+                samples['wall'].append(self.usage['wall'])
+                if 'user' in self.usage:
+                    samples['cpu'].append(self.usage['user']
+                                          + self.usage['sys'])
+            self.bench[self.base_id(id)] = \
+                { metric: bench_statistics(values)
+                  for metric, values in samples.items() if values }
+
+    def _report_bench(self):
+        """Report the statistics in .bench, write them to bench_output and
+        compare them with bench_baseline, as described under BENCHMARKING.
+        Returns false iff there is a regression."""
+        print()
+        print("{:<24} {:>4} {:>9} {:>9} {:>9} {:>9}"
+              .format("Test", "Time", "Min(s)", "Median(s)", "P95(s)",
+                      "Stddev(s)"))
+        for id, metrics in self.bench.items():
+            for metric, stats in metrics.items():
+                print("{:<24} {:>4} {min:>9.3f} {median:>9.3f} {p95:>9.3f} "
+                      "{stdev:>9.3f}".format(id[:24], metric, **stats))
+        if self.bench_output:
+            with open(self.bench_output, "w") as out:
+                json.dump({ 'runs': self.bench_runs, 'tests': self.bench },
+                          out, indent=1)
+        if not self.bench_baseline:
+            return True
+        try:
+            with open(self.bench_baseline) as inp:
+                baseline = json.load(inp)['tests']
+        except (OSError, ValueError, KeyError, TypeError) as excp:
+            print("Could not read baseline {}: {}"
+                  .format(self.bench_baseline, excp))
+            return False
+        regressions = 0
+        print()
+        for id, metrics in self.bench.items():
+            for metric, stats in metrics.items():
+                try:
+                    old = baseline[id][metric]['median']
+                except (KeyError, TypeError):
+                    continue
+                if stats['median'] > old * (1 + self.bench_threshold):
+                    regressions += 1
+                    print("** {id} REGRESSED ({metric} median {new:.3f}s vs. "
+                          "{old:.3f}s in baseline)"
+                          .format(id=id, metric=metric, new=stats['median'],
+                                  old=old))
+        if regressions:
+            print("{} regressions beyond {:.0%} of baseline."
+                  .format(regressions, self.bench_threshold))
+        else:
+            print("No regressions beyond {:.0%} of baseline."
+                  .format(self.bench_threshold))
+        return regressions == 0
+
+def shard_tests(tests, index, count, duration):
+    """The INDEXth (numbering from 1) of COUNT disjoint parts of the list
+    TESTS, in their order in TESTS.  The parts are balanced by the
+    function DURATION, which gives an expected duration for each test (or
+    None if unknown), by assigning tests, longest first, each to the part
+    whose total is least so far.  The result depends only on the names
+    and durations of TESTS, not their order."""
+    if not 1 <= index <= count:
+        raise ValueError("invalid shard: {}/{}".format(index, count))
+    times = { id: duration(id) for id in tests }
+    known = [ t for t in times.values() if t is not None ]
+    default = sum(known) / len(known) if known else 1.0
+    totals = [ 0.0 ] * count
+    chosen = set()
+    for id in sorted(set(tests),
+                     key=lambda id: (-(times[id] if times[id] is not None
+                                       else default), id)):
+        part = min(range(count), key=lambda k: (totals[k], k))
+        totals[part] += times[id] if times[id] is not None else default
+        if part == index - 1:
+            chosen.add(id)
+    return [ id for id in tests if id in chosen ]
+
+@contextmanager
+def report_lines(id, entry, filter):
+    """A context manager yielding an iterator over pairs (N, LINE) for the
+    reportable file ENTRY (see REPORTING) of test ID, where N is a line
+    number and LINE is line N after conversion by FILTER and removal of
+    trailing whitespace.  Lines that FILTER removes entirely are skipped.
+    Files are read a line at a time."""
+    _, filename, content = entry
+    if filename is None:
+        lines = StringIO(content)
+    else:
+        try:
+            lines = open(filename, errors="replace")
+        except OSError:
+            lines = StringIO("")
+    with lines:
+        yield ( (n, line.rstrip())
+                for n, line in ( (n, filter(id, raw))
+                                 for n, raw in enumerate(lines, 1) )
+                if line != "" )
+
+def first_difference(expected, actual, context):
+    """A unified-diff hunk (a list of lines) describing the first
+    difference between the sequences EXPECTED and ACTUAL of pairs
+    (LINE NUMBER, TEXT), with CONTEXT lines of context, or None if they
+    have the same texts.  Consumes the sequences only up to DIFF_WINDOW
+    lines past their first difference."""
+    expected, actual = iter(expected), iter(actual)
+    before = deque(maxlen=context)
+    while True:
+        e, a = next(expected, None), next(actual, None)
+        if e is None and a is None:
+            return None
+        if e is None or a is None or e[1] != a[1]:
+            break
+        before.append(a)
+    before = list(before)
+    exp = before + [ x for x in (e,) if x ] \
+          + list(islice(expected, DIFF_WINDOW - 1))
+    act = before + [ x for x in (a,) if x ] \
+          + list(islice(actual, DIFF_WINDOW - 1))
+    group = next(iter(SequenceMatcher(None, [ x[1] for x in exp ],
+                                      [ x[1] for x in act ],
+                                      autojunk=False)
+                      .get_grouped_opcodes(context)))
+    def start(lines, k):
+        if k < len(lines):
+            return lines[k][0]
+        return lines[-1][0] + 1 if lines else 1
+    i1, i2 = group[0][1], group[-1][2]
+    j1, j2 = group[0][3], group[-1][4]
+    hunk = [ "@@ -{},{} +{},{} @@".format(start(exp, i1), i2 - i1,
+                                         start(act, j1), j2 - j1) ]
+    for tag, i1, i2, j1, j2 in group:
+        if tag == 'equal':
+            hunk += [ " " + x[1] for x in act[j1:j2] ]
+            continue
+        hunk += [ "-" + x[1] for x in exp[i1:i2] ]
+        hunk += [ "+" + x[1] for x in act[j1:j2] ]
+    return hunk
+
+def bench_statistics(values):
+    """A dictionary of the minimum, median, 95th percentile (nearest
+    rank), and population standard deviation of the list VALUES."""
+    ordered = sorted(values)
+    return { 'min': ordered[0], 'median': statistics.median(ordered),
+             'p95': ordered[max(0, -(-95 * len(ordered) // 100) - 1)],
+             'stdev': statistics.pstdev(ordered) }
+
+def parse_java_command(command):
+    """Split the shell command COMMAND, which must have the form
+        java OPTIONS CLASS ARGS
+    into a tuple (JAVA, OPTIONS, CLASSPATH, CLASS, ARGS), where OPTIONS and
+    ARGS are lists of strings and CLASSPATH is the value of any -cp or
+    -classpath option (otherwise None).  Raises ValueError if COMMAND does
+    not have this form."""
+    words = shlex.split(command)
+    if not words or splitext(basename(words[0]))[0] != "java":
+        raise ValueError("not a java command: {}".format(command))
+    options = []
+    classpath = None
+    k = 1
+    while k < len(words) and words[k].startswith("-"):
+        if words[k] in ("-cp", "-classpath", "--class-path") \
+           and k + 1 < len(words):
+            classpath = words[k + 1]
+            k += 2
+        elif words[k] == "-jar":
+            raise ValueError("cannot serve executable JAR files: {}"
+                             .format(command))
+        else:
+            options.append(words[k])
+            k += 1
+    if k == len(words):
+        raise ValueError("no main class in {}".format(command))
+    return words[0], options, classpath, words[k], words[k+1:]
+
+def _read_limited(stream, limit, chunks):
+    """Read STREAM to its end, appending up to LIMIT bytes of it (all, if
+    LIMIT is None) to the list CHUNKS and discarding the rest."""
+    with stream:
+        size = 0
+        for chunk in iter(lambda: stream.read1(STREAM_CHUNK), b""):
+            if limit is None:
+                chunks.append(chunk)
+            elif size < limit:
+                chunks.append(chunk[:limit - size])
+            size += len(chunk)
+
+def _set_limits(limits, pid=0):
+    """Impose LIMITS, a sequence of pairs (RESOURCE, LIMIT) as for
+    resource.setrlimit, on process PID (0 for this process).  Only the soft
+    limit is set for RLIMIT_CPU (so that the process gets SIGXCPU), as
+    for 'ulimit -St'."""
+    for res, limit in limits:
+        soft, hard = resource.getrlimit(res)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        new = (limit, hard) if res == resource.RLIMIT_CPU else (limit, limit)
+        if pid:
+            resource.prlimit(pid, res, new)
+        else:
+            resource.setrlimit(res, new)
+
+def wait_for_usage(proc):
+    """Wait for the Popen PROC to terminate, set its returncode, and return
+    its resource usage as a dictionary (see RESOURCE USAGE), without
+    'wall'.  Returns an empty dictionary if os.wait4 is unavailable."""
+    if not hasattr(os, "wait4"):
+        proc.wait()
+        return {}
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        proc.wait()
+        return {}
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return { 'user': usage.ru_utime, 'sys': usage.ru_stime,
+             'maxrss': usage.ru_maxrss // MAXRSS_PER_KB,
+             'minflt': usage.ru_minflt, 'majflt': usage.ru_majflt }
+
+def decode_output(data):
+    """The bytes DATA decoded as text in the same way as Popen with
+    universal_newlines=True."""
+    return TextIOWrapper(BytesIO(data)).read()
+
+_server_dirs = {}
+_server_lock = Lock()
+
+def _server_classes(java):
+    """The directory containing MainServer.class, compiled on first use
+    from the MainServer.java in this directory by the javac that
+    accompanies the java command JAVA."""
+    with _server_lock:
+        if java not in _server_dirs:
+            javac = join(dirname(java), "javac") if dirname(java) else "javac"
+            classes = mkdtemp(prefix="mainserver")
+            atexit.register(rmtree, classes, True)
+            check_call([javac, "-d", classes,
+                        join(dirname(abspath(__file__)), "MainServer.java")],
+                       stdin=DEVNULL)
+            _server_dirs[java] = classes
+        return _server_dirs[java]
+
+class JvmPool:
+    """A pool of long-lived JVMs that run the main program of a Java
+    command repeatedly, using MainServer.java in this directory.  Each call
+    to .run takes an idle JVM, starting a new one if needed, so that the
+    number of JVMs grows to the number of concurrent callers."""
+
+    # Number of runs after which a JVM is retired, to bound the effects of
+    # anything leaked by the tested program.
+    MAX_RUNS = 100
+
+    def __init__(self, command, merge_stderr=False):
+        """A pool for the command COMMAND (as for parse_java_command).
+        If MERGE_STDERR, the standard error of each run is merged with its
+        standard output, as for stderr=STDOUT in subprocess."""
+        java, options, classpath, main_class, self._args = \
+            parse_java_command(command)
+        if classpath is None:
+            classpath = environ.get("CLASSPATH", ".")
+        self._argv = [java] + options \
+            + ["-cp", _server_classes(java) + pathsep + classpath,
+               "MainServer"] \
+            + (["--merge-stderr"] if merge_stderr else []) + [main_class]
+        self._idle = []
+        self._lock = Lock()
+
+    def run(self, stdin, timeout=None, args=None):
+        """Run the program with the bytes STDIN as its standard input and
+        ARGS (by default, those in the command) as its arguments, allowing
+        it TIMEOUT seconds (None for no limit).  Returns a triple
+        (RC, STDOUT, STDERR), where STDOUT and STDERR are bytes.  A JVM
+        that exceeds TIMEOUT or that dies is replaced."""
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+        if worker is None or not worker.alive():
+            worker = _JvmWorker(self._argv)
+        result = worker.run(self._args if args is None else args,
+                            stdin, timeout)
+        if worker.alive() and worker.runs < self.MAX_RUNS:
+            with self._lock:
+                self._idle.append(worker)
+        else:
+            worker.stop()
+        return result
+
+    def close(self):
+        """Stop all idle JVMs."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+class _JvmWorker:
+    """One MainServer JVM, started with the command line ARGV."""
+
+    def __init__(self, argv):
+        self._proc = Popen(argv, stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+        self.runs = 0
+
+    def alive(self):
+        return self._proc.poll() is None
+
+    def run(self, args, stdin, timeout):
+        """Send a request to run the program with arguments ARGS and
+        standard input STDIN, returning (RC, STDOUT, STDERR).  If TIMEOUT
+        expires first, kill this JVM and return an exit code indicating
+        that the time limit was exceeded."""
+        self.runs += 1
+        self._timed_out = False
+        timer = Timer(timeout, self._time_out) if timeout else None
+        request = [ struct.pack(">i", len(args)) ]
+        for arg in args + [ stdin ]:
+            if type(arg) is str:
+                arg = arg.encode("utf-8")
+            request += [ struct.pack(">i", len(arg)), arg ]
+        try:
+            if timer:
+                timer.start()
+            self._proc.stdin.write(b"".join(request))
+            self._proc.stdin.flush()
+            rc = self._read_int()
+            stdout = self._read_block()
+            stderr = self._read_block()
+            if self._read_int():
+                self._proc.wait()
+            return rc, stdout, stderr
+        except (OSError, EOFError):
+            self.stop()
+            if self._timed_out:
+                return 128 + SIGXCPU, b"", b""
+            return -SIGKILL, b"", b"JVM worker terminated unexpectedly\n"
+        finally:
+            if timer:
+                timer.cancel()
+
+    def stop(self):
+        try:
+            self._proc.stdin.close()
+        except (OSError, ValueError):
+            pass
+        try:
+            self._proc.wait(timeout=1)
+        except TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+    def _time_out(self):
+        self._timed_out = True
+        self._proc.kill()
+
+    def _read_exactly(self, n):
+        data = self._proc.stdout.read(n)
+        if len(data) != n:
+            raise EOFError
+        return data
+
+    def _read_int(self):
+        return struct.unpack(">i", self._read_exactly(4))[0]
+
+    def _read_block(self):
+        return self._read_exactly(self._read_int())
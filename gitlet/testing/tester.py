@@ -1,14 +1,29 @@
-import sys, re
+import sys, re, json, shlex, struct, atexit, hashlib, csv, random, mmap
 from subprocess import \
-     check_output, PIPE, STDOUT, DEVNULL, CalledProcessError, TimeoutExpired
-from os.path import abspath, basename, dirname, exists, join, splitext
+     check_output, check_call, Popen, PIPE, STDOUT, DEVNULL, \
+     CalledProcessError, TimeoutExpired
+from os.path import \
+     abspath, basename, dirname, exists, join, splitext, normpath, relpath, \
+     isdir, getsize
 from getopt import getopt, GetoptError
-from os import chdir, environ, getcwd, mkdir, remove, access, W_OK
-from shutil import copyfile, rmtree
-from math import log
+from os import environ, getcwd, mkdir, remove, access, W_OK, walk, \
+     makedirs, replace, pathsep, stat, cpu_count
+from shutil import copyfileobj, copystat, copytree, rmtree
+from math import log, ceil
+from time import monotonic, time
+from threading import Timer, Lock, Thread, local
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import mkdtemp
+from io import BytesIO, TextIOWrapper
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 SHORT_USAGE = """\
 Usage: python3 tester.py OPTIONS TEST.in ...
+       python3 tester.py --merge [--json=FILE] SHARD.json ...
 
    OPTIONS may include
        --show=N       Show details on up to N tests.
@@ -19,11 +34,31 @@ Usage: python3 tester.py OPTIONS TEST.in ...
                       of gitlet.
        --src=SRC      Use SRC instead of "src" as the subdirectory containing
                       files referenced by + and =.
+       --scratch=DIR  Create the directories for the tests under DIR
+                      (default a RAM-backed directory such as /dev/shm,
+                      if there is one, except with --keep).
        --debug        Allows you to step through commands one by one and
                       attach a remote debugger
        --tolerance=N  Set the maximum allowed edit distance between program
                       output and expected output to N (default 3).
        --verbose      Print extra information about execution.
+       -j N, --jobs=N Run up to N tests at once (0 for one per CPU).  The
+                      output of each test is shown when it finishes, in the
+                      order of the tests.
+       --jvm          Run the gitlet commands of each test directory in one
+                      long-lived JVM, rather than one JVM per command.
+       --share-prefixes
+                      Run the instructions that tests begin with in common
+                      once, and start each such test from a copy of the
+                      resulting directory.
+       --shard=I/N    Run only the Ith of N parts of the tests, balanced by
+                      their durations on earlier runs.
+       --json=FILE    Write the results of the tests to FILE as JSON.
+       --profile=FILE Time each gitlet command, write the timings to FILE
+                      (as CSV if FILE ends in .csv, and otherwise as JSON),
+                      and print a summary by command.
+       --merge        Combine the results in the JSON files SHARD.json
+                      written by --json into a single report.
 """
 
 USAGE = SHORT_USAGE + """\
@@ -63,9 +98,24 @@ The instructions each have one of the following forms:
           Python regular expressions and matched accordingly. The directory
           or JAR file containing the gitlet.Main program is assumed to be
           in directory DIR specifed by --progdir (default is ..).
+   G NAME SIZE SEED [COUNT]
+          Create a file named NAME containing SIZE bytes of text generated
+          from the integer SEED, always the same for the same SIZE and SEED.
+          SIZE may end in k, M, or G (units of 2**10, 2**20, or 2**30
+          bytes).  With COUNT, instead create COUNT such files, replacing
+          {} in NAME with 0, 1, ..., COUNT-1, and using seeds SEED, SEED+1,
+          ....  The files are written a piece at a time, so they may be
+          larger than memory.
    = NAME F
           Check that the file named NAME is identical to src/F, and report an
           error if not.
+   = NAME @SIZE:SEED
+          Check that the file named NAME contains the text that G NAME SIZE
+          SEED creates.
+          The files compared by = are hashed a piece at a time (ignoring
+          differences among CR LF, CR, and LF line terminators), and the
+          hashes of the files in src/ and of generated text are computed
+          once per run.
    * NAME
           Check that the file NAME does not exist, and report an error if it
           does.
@@ -84,15 +134,82 @@ tests.  With --keep, keeps the directories created for the tests (with names
 TEST.dir).
 
 When finished, reports number of tests passed and failed, and the number of
-faulty TEST.in files."""
+faulty TEST.in files.
+
+With --profile=FILE, records for each ">" command the test and line, the
+gitlet command (its first word) and operands, the elapsed time in seconds,
+the numbers of commits and objects in the repository just before the
+command (the numbers of files in .gitlet/commits and in all of .gitlet
+in the command's directory), and its outcome ("OK" or the error).  FILE
+gets one row or JSON object per command, in the order of the tests.  The
+summary ranks the gitlet commands by their total time, and gives for each
+the number of executions and the mean, 95th percentile, and maximum
+times, with its rank by 95th percentile.  With --debug, commands are not
+timed.
+
+The directories for the tests go in a new directory under the directory
+given by --scratch.  Without --scratch, that is a RAM-backed directory
+(/dev/shm) where there is a writable one, and otherwise (and always with
+--keep) the tests' directories go in the current directory.  Files are
+copied from SRC sharing their contents copy-on-write where the file system
+allows (not by hard links, since gitlet may rewrite the copies in place),
+and test directories are removed by a background thread, so that removing
+them does not delay the next test.  The program waits for those removals
+to finish before exiting.
+
+With --jvm, the commands of a test run in a JVM started in the test's
+directory (or in the directory selected by C) using MainServer.java in this
+directory.  Each command runs gitlet.Main.main with freshly loaded classes,
+so no static state carries over between commands, and a call to System.exit
+just ends the command with the given exit code.  Output and exit codes are
+as for a separate JVM.  The JVM is stopped at the end of the test.
+
+Before running a TEST.in, the tester compiles it into a list of steps, one
+per instruction, with the instructions of included files (I) in place and the
+expected output of each ">" command gathered with it.  Compiled scripts are
+kept in .tester-cache/scripts.json and reused as long as the contents of
+TEST.in and its included files are unchanged.  Instructions containing
+substitutions (${...}) other than ">" commands and their expected output
+are parsed when executed; a substitution may not turn a line into a ">"
+command.
+
+With --share-prefixes, the tester finds, for each test, the longest sequence
+of instructions (ignoring comments) with which it and at least one other
+test begin, provided the sequence includes a ">" command.  It executes
+each such sequence once in a directory of its own (starting from a copy of
+the directory for the longest shorter sequence that it extends, if any) and
+runs the rest of each test in a copy of that directory, with the variables,
+captured groups, timeout and current directory as they were at the end of
+the sequence.  Files are copied with their modification times, and the
+contents are shared copy-on-write where the file system allows (gitlet
+rewrites files in place, so hard links would not be safe).  Commits made
+in the shared instructions therefore carry the times at which the
+instructions ran, which precede the rest of the test as they would have
+otherwise.  If the shared instructions fail, the tests run in full and
+report the error as usual.  Option --share-prefixes has no effect with
+--verbose or --debug, and gitlet implementations that record the absolute
+path of their directory may not work with it.
+
+Each run records the duration and outcome of each test in
+.tester-cache/history.json.  With --shard=I/N, divides the tests into N
+parts by assigning them, longest first, each to the part with the least
+total duration so far, and runs only the Ith part.  The division
+depends only on the test names and the recorded history, which sharded runs
+do not change, so that runs of all N parts with the same history run each
+test exactly once.  To combine their results (and record the durations in
+the history), use --json=SHARD.json for each part, and then --merge with
+all the SHARD.json files."""
 
 TIMEOUT = 10
 
+CACHE_DIR = ".tester-cache"
+
 JAVA_COMMAND = "java -ea"
 GITLET_CLASS = "gitlet.Main"
 JVM_OPTIONS = "-agentlib:jdwp=transport=dt_socket,server=y,suspend=y,address=5005"
 
 DEBUG = False
+USE_SERVER = False
 DEBUG_MSG = \
     """You are in debug mode.
     In this mode, you will be shown each command from the test case.
@@ -103,14 +220,39 @@ def Usage():
     print(SHORT_USAGE, file=sys.stderr)
     sys.exit(1)
 
-Mat = None
+# The last match by Match, per thread.
+matches = local()
 def Match(patn, s):
-    global Mat
-    Mat = re.match(patn, s)
-    return Mat
+    matches.last = re.match(patn, s)
+    return matches.last
 
 def Group(n):
-    return Mat.group(n)
+    return matches.last.group(n)
+
+def Groups():
+    return matches.last.groups()
+
+# The buffered output of the test running in the current thread, if any.
+output = local()
+
+class TestOutput:
+    """A replacement for the standard output STREAM, used with -j, that
+    saves the output of each test run by runBufferedTest until it can be
+    shown in order."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = getattr(output, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        if getattr(output, 'buffer', None) is None:
+            self.stream.flush()
 
 def contents(filename):
     try:
@@ -119,19 +261,250 @@ def contents(filename):
     except FileNotFoundError:
         return None
 
-def editDistance(s1, s2):
-    dist = [list(range(len(s2) + 1))] + \
-           [ [i] + [ 0 ] * len(s2) for i in range(1, len(s1) + 1) ]
+def editDistance(s1, s2, limit=None):
+    """The edit distance between S1 and S2.  If LIMIT is not None, the
+    result is exact only if it is at most LIMIT, and is otherwise LIMIT+1.
+    Only the diagonal band of width 2*LIMIT+1 is computed, stopping as
+    soon as every entry in a row exceeds LIMIT, so the time is
+    O(LIMIT * len(S1)) and the space O(len(S2))."""
+    if limit is None:
+        limit = max(len(s1), len(s2))
+    big = limit + 1
+    if s1 == s2:
+        return 0
+    elif limit == 0 or abs(len(s1) - len(s2)) > limit:
+        return big
+    n = len(s2)
+    prev = [ min(j, big) for j in range(n + 1) ] + [ big ]
+    curr = [ big ] * (n + 2)
     for i in range(1, len(s1) + 1):
-        for j in range(1, len(s2) + 1):
-            dist[i][j] = min(dist[i-1][j] + 1,
-                             dist[i][j-1] + 1,
-                             dist[i-1][j-1] + (s1[i-1] != s2[j-1]))
-    return dist[len(s1)][len(s2)]
+        lo, hi = max(1, i - limit), min(n, i + limit)
+        curr[lo - 1] = min(i, big) if lo == 1 else big
+        c1 = s1[i-1]
+        best = curr[lo - 1]
+        for j in range(lo, hi + 1):
+            d = min(prev[j] + 1, curr[j-1] + 1, prev[j-1] + (c1 != s2[j-1]),
+                    big)
+            curr[j] = d
+            if d < best:
+                best = d
+        curr[hi + 1] = big
+        if best > limit:
+            return big
+        prev, curr = curr, prev
+    return prev[n]
+
+def loadHistory():
+    try:
+        with open(join(CACHE_DIR, "history.json")) as inp:
+            history = json.load(inp)
+        return history if type(history) is dict else {}
+    except (OSError, ValueError):
+        return {}
+
+def saveHistory(results):
+    history = loadHistory()
+    for result in results:
+        history[abspath(result['id'])] = \
+            { 'failed': result['outcome'] != 'passed',
+              'duration': round(result['usage']['wall'], 3) }
+    try:
+        makedirs(CACHE_DIR, exist_ok=True)
+        tmp = join(CACHE_DIR, "history.json.tmp")
+        with open(tmp, "w") as out:
+            json.dump(history, out)
+        replace(tmp, join(CACHE_DIR, "history.json"))
+    except OSError:
+        pass
+
+def shardTests(files, index, count, history):
+    """The INDEXth (numbering from 1) of COUNT disjoint parts of FILES,
+    in their order in FILES, balanced by the durations in HISTORY."""
+    times = { test: (history.get(abspath(test)) or {}).get('duration')
+              for test in files }
+    known = [ t for t in times.values() if t is not None ]
+    default = sum(known) / len(known) if known else 1.0
+    times = { test: default if t is None else t for test, t in times.items() }
+    totals = [ 0.0 ] * count
+    chosen = set()
+    for test in sorted(times, key=lambda test: (-times[test], test)):
+        part = min(range(count), key=lambda k: (totals[k], k))
+        totals[part] += times[test]
+        if part == index - 1:
+            chosen.add(test)
+    return [ test for test in files if test in chosen ]
+
+def writeReport(filename, num_tests, passed, results):
+    with open(filename, "w") as out:
+        json.dump({ 'tests': num_tests, 'passed': passed,
+                    'results': results }, out, indent=1)
+
+def reportTotals(num_tests, passed):
+    print()
+    print("Ran {} tests. ".format(num_tests), end="")
+    if passed == num_tests:
+        print("All passed.")
+    else:
+        print("{} passed.".format(passed))
+
+# Timings of gitlet commands (see --profile).
+profile = []
+profile_lock = Lock()
+
+PROFILE_FIELDS = ('test', 'line', 'command', 'operands', 'seconds',
+                  'commits', 'objects', 'outcome')
+
+def repositorySize(dir):
+    """A pair (COMMITS, OBJECTS) giving the numbers of files in
+    .gitlet/commits and in all of .gitlet under DIR."""
+    commits = objects = 0
+    gitlet = join(dir, ".gitlet")
+    for root, dirs, names in walk(gitlet):
+        objects += len(names)
+        if root == join(gitlet, "commits"):
+            commits = len(names)
+    return commits, objects
+
+def recordCommand(test, line_num, cmnd, seconds, size, outcome):
+    """Add the timing SECONDS of gitlet command CMND at LINE_NUM of TEST,
+    executed in a repository whose repositorySize was SIZE and resulting
+    in OUTCOME, to profile."""
+    words = cmnd.split(None, 1) + ["", ""]
+    with profile_lock:
+        profile.append({ 'test': test, 'line': line_num,
+                         'command': words[0], 'operands': words[1],
+                         'seconds': round(seconds, 6),
+                         'commits': size[0], 'objects': size[1],
+                         'outcome': outcome })
+
+def percentile(values, fraction):
+    """The nearest-rank FRACTION percentile of the sorted list VALUES."""
+    return values[max(0, ceil(fraction * len(values)) - 1)]
+
+def profileSummary():
+    """A list of summaries of the times in profile for each gitlet
+    command, as dictionaries, in decreasing order of total time."""
+    times = {}
+    for entry in profile:
+        times.setdefault(entry['command'], []).append(entry['seconds'])
+    summary = []
+    for command, values in times.items():
+        values.sort()
+        summary.append({ 'command': command, 'count': len(values),
+                         'total': sum(values),
+                         'mean': sum(values) / len(values),
+                         'p95': percentile(values, 0.95),
+                         'max': values[-1] })
+    for rank, entry in enumerate(sorted(summary, key=lambda e: -e['p95']),
+                                 1):
+        entry['p95_rank'] = rank
+    summary.sort(key=lambda e: -e['total'])
+    return summary
+
+def writeProfile(filename, files):
+    """Write profile to FILENAME, ordered as for FILES, as CSV if
+    FILENAME ends in .csv and otherwise as JSON."""
+    order = { test: k for k, test in enumerate(files) }
+    profile.sort(key=lambda entry: order.get(entry['test'], len(order)))
+    with open(filename, "w", newline="") as out:
+        if filename.endswith(".csv"):
+            writer = csv.DictWriter(out, PROFILE_FIELDS)
+            writer.writeheader()
+            writer.writerows(profile)
+        else:
+            json.dump({ 'commands': profile, 'summary': profileSummary() },
+                      out, indent=1)
+
+def reportProfile():
+    """Print the summary of profile."""
+    print()
+    print("Gitlet command times (seconds), by total time:")
+    print("    {:<16} {:>6} {:>9} {:>8} {:>8} {:>8} {:>8}"
+          .format("command", "count", "total", "mean", "p95", "max",
+                  "p95 rank"))
+    for entry in profileSummary():
+        print("    {command:<16} {count:>6} {total:>9.3f} {mean:>8.3f} "
+              "{p95:>8.3f} {max:>8.3f} {p95_rank:>8}".format(**entry))
+
+def mergeReports(filenames):
+    num_tests = passed = 0
+    results = []
+    for filename in filenames:
+        try:
+            with open(filename) as inp:
+                report = json.load(inp)
+        except (OSError, ValueError) as excp:
+            print("Could not read {}: {}".format(filename, excp),
+                  file=sys.stderr)
+            sys.exit(1)
+        num_tests += report['tests']
+        passed += report['passed']
+        results += report['results']
+    return num_tests, passed, results
+
+# Directory containing the test directories.
+scratch_dir = None
+
+# Directories to try, in order, as the default for --scratch.
+RAM_DIRS = ("/dev/shm",)
+
+def ramDirectory():
+    """A writable RAM-backed directory from RAM_DIRS, or None if there is
+    none."""
+    for dir in RAM_DIRS:
+        if isdir(dir) and access(dir, W_OK):
+            return dir
+    return None
+
+# Size of the pieces in which generated files are made and compared.
+GENERATED_CHUNK = 1 << 20
+
+# Characters of generated text, indexed by random bytes (four copies of 64).
+GENERATED_TEXT = bytes.maketrans(
+    bytes(range(256)),
+    4 * b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 \n")
+
+def parseSize(text):
+    """The number of bytes denoted by TEXT, a decimal numeral possibly
+    followed by k, M, or G."""
+    if not Match(r'(\d+)([kMG]?)$', text):
+        raise ValueError("bad size: {}".format(text))
+    return int(Group(1)) << { "": 0, "k": 10, "M": 20, "G": 30 }[Group(2)]
+
+def parseSeed(text):
+    """The seed denoted by TEXT, an integer numeral."""
+    if not Match(r'-?\d+$', text):
+        raise ValueError("bad seed: {}".format(text))
+    return int(text)
+
+def generatedText(size, seed):
+    """The SIZE bytes of text generated from SEED, as a sequence of pieces
+    of at most GENERATED_CHUNK bytes."""
+    rand = random.Random(seed)
+    while size > 0:
+        n = min(size, GENERATED_CHUNK)
+        yield rand.randbytes(n).translate(GENERATED_TEXT)
+        size -= n
+
+def doGenerate(name, size, seed, count, dir):
+    size, seed = parseSize(size), parseSeed(seed)
+    if count is None:
+        names = [ (name, seed) ]
+    else:
+        names = ( (name.replace("{}", str(k)), seed + k)
+                  for k in range(int(count)) )
+    for file_name, file_seed in names:
+        try:
+            with open(join(dir, file_name), 'wb') as out:
+                for data in generatedText(size, file_seed):
+                    out.write(data)
+        except OSError:
+            raise ValueError("file {} could not be generated"
+                             .format(file_name))
 
 def createTempDir(base):
     for n in range(100):
-        name = "{}_{}".format(base, n)
+        name = join(scratch_dir, "{}_{}".format(base, n))
         try:
             mkdir(name)
             return name
@@ -140,8 +513,25 @@ def createTempDir(base):
     else:
         raise ValueError("could not create temp directory for {}".format(base))
 
+# Directories waiting for removal by reapDirectories.
+reap_queue = Queue()
+
+def reapDirectories():
+    """Remove the directories put on reap_queue, as they arrive."""
+    while True:
+        dir = reap_queue.get()
+        rmtree(dir, ignore_errors=True)
+        reap_queue.task_done()
+
 def cleanTempDir(dir):
-    rmtree(dir, ignore_errors=True)
+    reap_queue.put(dir)
+
+def finishCleanup(dir):
+    """Wait for directories passed to cleanTempDir to be removed, and
+    then remove DIR as well, unless it is None."""
+    reap_queue.join()
+    if dir is not None:
+        rmtree(dir, ignore_errors=True)
 
 def doDelete(name, dir):
     try:
@@ -152,15 +542,36 @@ def doDelete(name, dir):
 def doCopy(dest, src, dir):
     try:
         doDelete(dest, dir)
-        copyfile(join(src_dir, src), join(dir, dest))
+        cloneFile(join(src_dir, src), join(dir, dest))
     except OSError:
         raise ValueError("file {} could not be copied to {}".format(src, dest))
 
+# The Linux ioctl that makes a file share the data of another copy-on-write.
+FICLONE = 0x40049409
+
+def cloneFile(src, dest):
+    """Copy the contents of file SRC to DEST, sharing SRC's data
+    copy-on-write if the file system supports it.  Returns DEST."""
+    with open(src, 'rb') as inp, open(dest, 'wb') as out:
+        try:
+            if fcntl is None:
+                raise OSError
+            fcntl.ioctl(out.fileno(), FICLONE, inp.fileno())
+        except OSError:
+            copyfileobj(inp, out)
+    return dest
+
+def cloneTree(src, dest):
+    """Copy the contents of directory SRC into the existing directory
+    DEST, using cloneFile to copy files and keeping their permissions and
+    times."""
+    def cloneWithStat(src, dest):
+        copystat(src, cloneFile(src, dest))
+    copytree(src, dest, copy_function=cloneWithStat, dirs_exist_ok=True)
+
 def doExecute(cmnd, dir, timeout, line_num):
-    here = getcwd()
     out = ""
     try:
-        chdir(dir)
         full_cmnd = "{} {} {}".format(JAVA_COMMAND, GITLET_CLASS, cmnd)
         skip_first_line = False
 
@@ -176,24 +587,135 @@ def doExecute(cmnd, dir, timeout, line_num):
                 full_cmnd = "{} {} {} {}".format(JAVA_COMMAND, JVM_OPTIONS, GITLET_CLASS, cmnd)
                 timeout, skip_first_line = None, True
 
-        out = doCommand(full_cmnd, timeout, skip_first_line)
+        if USE_SERVER and not skip_first_line:
+            out = doServerCommand(cmnd, abspath(dir), timeout)
+        else:
+            out = doCommand(full_cmnd, dir, timeout, skip_first_line)
         return "OK", out
     except CalledProcessError as excp:
         return ("java gitlet.Main exited with code {}".format(excp.args[0]),
                 excp.output)
     except TimeoutExpired:
         return "timeout", None
-    finally:
-        chdir(here)
 
-def doCommand(full_cmnd, timeout, skip_first_line=False):
+def doCommand(full_cmnd, dir, timeout, skip_first_line=False):
     out = check_output(full_cmnd, shell=True, universal_newlines=True,
-                        stdin=DEVNULL, stderr=STDOUT, timeout=timeout)
+                        stdin=DEVNULL, stderr=STDOUT, timeout=timeout,
+                        cwd=dir)
     if skip_first_line:
         out = out.split("\n", 1)[1]
 
     return out
 
+servers = {}
+server_classes = None
+server_lock = Lock()
+
+def doServerCommand(cmnd, dir, timeout):
+    """Run gitlet.Main with the arguments in CMND (split as by a shell) in
+    the GitletServer for directory DIR (a full path), returning its
+    output.  Raises CalledProcessError or TimeoutExpired just as doCommand
+    does."""
+    if dir not in servers or not servers[dir].alive():
+        servers[dir] = GitletServer(dir)
+    server = servers[dir]
+    rc, out = server.run(shlex.split(cmnd), timeout)
+    if not server.alive():
+        del servers[dir]
+    out = TextIOWrapper(BytesIO(out)).read()
+    if rc != 0:
+        raise CalledProcessError(rc, cmnd, out)
+    return out
+
+def stopServers(tmpdir):
+    """Stop the GitletServers for TMPDIR and its subdirectories."""
+    for dir in list(servers):
+        if dir == tmpdir or dir.startswith(join(tmpdir, "")):
+            servers.pop(dir).stop()
+
+class GitletServer:
+    """A JVM running MainServer (see MainServer.java) in directory DIR, to
+    run gitlet.Main repeatedly with its standard error merged into its
+    standard output."""
+
+    def __init__(self, dir):
+        global server_classes
+        java = [ w for w in shlex.split(JAVA_COMMAND) if w != "exec" ]
+        with server_lock:
+            if server_classes is None:
+                javac = join(dirname(java[0]), "javac")
+                classes = mkdtemp(prefix="mainserver")
+                atexit.register(rmtree, classes, True)
+                check_call([javac, "-d", classes,
+                            join(dirname(abspath(__file__)),
+                                 "MainServer.java")],
+                           stdin=DEVNULL)
+                server_classes = classes
+        self._proc = Popen(java + [ "-cp", pathsep.join((server_classes,
+                                                         environ['CLASSPATH'])),
+                                    "MainServer", "--merge-stderr",
+                                    GITLET_CLASS ],
+                           cwd=dir, stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+
+    def alive(self):
+        return self._proc.poll() is None
+
+    def run(self, args, timeout):
+        """Run gitlet.Main with arguments ARGS, returning its exit code and
+        output (as bytes).  Raises TimeoutExpired (after stopping this
+        server) if it does not finish in TIMEOUT seconds."""
+        self._timedOut = False
+        timer = Timer(timeout, self._timeOut) if timeout else None
+        request = [ struct.pack(">i", len(args)) ]
+        for arg in [ a.encode("utf-8") for a in args ] + [ b"" ]:
+            request += [ struct.pack(">i", len(arg)), arg ]
+        try:
+            if timer:
+                timer.start()
+            self._proc.stdin.write(b"".join(request))
+            self._proc.stdin.flush()
+            rc = self._readInt()
+            out = self._readBlock()
+            self._readBlock()
+            if self._readInt():
+                self._proc.wait()
+            return rc, out
+        except (OSError, EOFError):
+            self.stop()
+            if self._timedOut:
+                raise TimeoutExpired(args, timeout)
+            return -9, b"JVM terminated unexpectedly\n"
+        finally:
+            if timer:
+                timer.cancel()
+
+    def stop(self):
+        try:
+            self._proc.stdin.close()
+        except (OSError, ValueError):
+            pass
+        try:
+            self._proc.wait(timeout=1)
+        except TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+    def _timeOut(self):
+        self._timedOut = True
+        self._proc.kill()
+
+    def _readExactly(self, n):
+        data = self._proc.stdout.read(n)
+        if len(data) != n:
+            raise EOFError
+        return data
+
+    def _readInt(self):
+        return struct.unpack(">i", self._readExactly(4))[0]
+
+    def _readBlock(self):
+        return self._readExactly(self._readInt())
+
 def canonicalize(s):
     if s is None:
         return None
@@ -202,10 +724,109 @@ def canonicalize(s):
 def fileExists(f, dir):
     return exists(join(dir, f))
 
+# Size of the pieces in which files are hashed.  Larger files without
+# carriage returns are hashed through mmap.
+HASH_CHUNK = 1 << 20
+
+def fileDigest(path):
+    """A pair (SIZE, DIGEST): the length and the sha256 digest of the
+    contents of file PATH, with line terminators \\r\\n and \\r replaced
+    by \\n, as when reading it as text.  None if there is no such file."""
+    try:
+        inp = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    digest = hashlib.sha256()
+    with inp:
+        if getsize(path) > HASH_CHUNK:
+            with mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data.find(b'\r') == -1:
+                    digest.update(data)
+                    return len(data), digest.digest()
+        size = 0
+        carry = b''
+        while True:
+            data = inp.read(HASH_CHUNK)
+            if not data:
+                break
+            data = carry + data
+            carry = b''
+            if data.endswith(b'\r'):
+                data, carry = data[:-1], b'\r'
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            size += len(data)
+            digest.update(data)
+        if carry:
+            size += 1
+            digest.update(b'\n')
+    return size, digest.digest()
+
+# Digests (as from fileDigest) of the files in src_dir and of generated
+# files, which do not change during a run, keyed by path or by (SIZE, SEED).
+fixture_digests = {}
+
+# Digests of files that have been checked, keyed by path, with the results
+# of stat that they are valid for.
+checked_digests = {}
+
+# The digest of a checked file is reused only if the file was last modified
+# at least this many seconds before it was hashed, since a file could
+# otherwise change again without its size or time stamp changing.
+RACY_INTERVAL = 2
+
+def fixtureDigest(name):
+    """The digest of file NAME in src_dir, as from fileDigest."""
+    path = join(src_dir, name)
+    if path not in fixture_digests:
+        fixture_digests[path] = fileDigest(path)
+    return fixture_digests[path]
+
+def generatedDigest(size, seed):
+    """The digest of the text generated from SIZE and SEED, as from
+    fileDigest."""
+    if (size, seed) not in fixture_digests:
+        digest = hashlib.sha256()
+        for data in generatedText(size, seed):
+            digest.update(data)
+        fixture_digests[size, seed] = size, digest.digest()
+    return fixture_digests[size, seed]
+
+def checkedDigest(path, expected):
+    """The digest of file PATH, as from fileDigest, or False if PATH is
+    too short to have the digest EXPECTED (as from fileDigest)."""
+    try:
+        info = stat(path)
+    except FileNotFoundError:
+        return None
+    if expected is not None and info.st_size < expected[0]:
+        return False
+    key = (info.st_size, info.st_mtime_ns, info.st_ino, info.st_dev)
+    cached = checked_digests.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    start = time()
+    digest = fileDigest(path)
+    if info.st_mtime < start - RACY_INTERVAL:
+        checked_digests[path] = key, digest
+    return digest
+
 def correctFileOutput(name, expected, dir):
-    userData = canonicalize(contents(join(dir, name)))
-    stdData = canonicalize(contents(join(src_dir, expected)))
-    return userData == stdData
+    try:
+        if expected.startswith("@"):
+            expected = generatedSpecDigest(expected)
+        else:
+            expected = fixtureDigest(expected)
+        return checkedDigest(join(dir, name), expected) == expected
+    except OSError:
+        return False
+
+def generatedSpecDigest(spec):
+    """The digest of the contents generated for SPEC, which has the form
+    @SIZE:SEED, as from fileDigest."""
+    if not Match(r'@(\S+):(\S+)$', spec):
+        raise ValueError("bad generated file: {}".format(spec))
+    size, seed = Group(1), Group(2)
+    return generatedDigest(parseSize(size), parseSeed(seed))
 
 def correctProgramOutput(expected, actual, last_groups, is_regexp):
     expected = re.sub(r'[ \t]+\n', '\n', '\n'.join(expected))
@@ -221,12 +842,16 @@ def correctProgramOutput(expected, actual, last_groups, is_regexp):
                 return False
         except:
             raise ValueError("bad pattern")
-        last_groups[:] += Mat.groups()
-    elif editDistance(expected.rstrip(), actual.rstrip()) > output_tolerance:
+        last_groups[:] += Groups()
+    elif editDistance(expected.rstrip(), actual.rstrip(),
+                      output_tolerance) > output_tolerance:
         return False
     return True
 
 def reportDetails(test, included_files, line_num):
+    if getattr(output, 'buffer', None) is not None:
+        output.buffer.append((test, included_files, line_num))
+        return
     if show is None:
         return
     if show <= 0:
@@ -251,143 +876,455 @@ def chop_nl(s):
     else:
         return s
 
-def line_reader(f, prefix):
-    n = 0
+def line_reader(f, prefix, deps):
     try:
-        with open(f) as inp:
-            while True:
-                L = inp.readline()
-                if L == '':
-                    return
-                n += 1
-                included_file = yield (prefix + str(n), L)
-                if included_file:
-                    yield None
-                    yield from line_reader(included_file, prefix + str(n) + ".")
+        with open(f, 'rb') as inp:
+            data = inp.read()
     except FileNotFoundError:
         raise ValueError("file {} not found".format(f))
+    deps[abspath(f)] = hashlib.sha256(data).hexdigest()
+    lines = TextIOWrapper(BytesIO(data)).readlines()
+    for n, L in enumerate(lines, 1):
+        included_file = yield (prefix + str(n), L)
+        if included_file:
+            yield None
+            yield from line_reader(included_file, prefix + str(n) + ".", deps)
 
-def doTest(test):
-    last_groups = []
-    base = splitext(basename(test))[0]
-    print("{}: ".format(base), end="")
-    cdir = tmpdir = createTempDir(base)
+# Version of the compiled form of test scripts.  Change whenever the form
+# produced by compileScript changes.
+SCRIPT_VERSION = 2
 
-    if verbose:
-        print("Testing directory: {}".format(tmpdir))
+def parseLine(line):
+    """The step (less its line number and text) for the instruction LINE
+    (after substitutions), other than the expected output of a ">"
+    command, or None if LINE is not a valid instruction."""
+    if Match(r'\s*#', line) or Match(r'\s+$', line):
+        return ['nop']
+    elif Match(r'I\s+(\S+)', line):
+        return ['include', Group(1)]
+    elif Match(r'C\s*(\S*)', line):
+        return ['cd', Group(1)]
+    elif Match(r'T\s*(\S+)', line):
+        try:
+            return ['timeout', float(Group(1))]
+        except ValueError:
+            return ['nop']
+    elif Match(r'\+\s*(\S+)\s+(\S+)', line):
+        return ['copy', Group(1), Group(2)]
+    elif Match(r'-\s*(\S+)', line):
+        return ['delete', Group(1)]
+    elif Match(r'>\s*(.*)', line):
+        return ['command', Group(1)]
+    elif Match(r'=\s*(\S+)\s+(\S+)', line):
+        return ['same', Group(1), Group(2)]
+    elif Match(r'\*\s*(\S+)', line):
+        return ['absent', Group(1)]
+    elif Match(r'E\s*(\S+)', line):
+        return ['present', Group(1)]
+    elif Match(r'(?s)D\s*([a-zA-Z_][a-zA-Z_0-9]*)\s*"(.*)"\s*$', line):
+        return ['define', Group(1), Group(2)]
+    elif Match(r'G\s+(\S+)\s+(\d+[kMG]?)\s+(-?\d+)(?:\s+(\d+))?\s*$', line):
+        return ['generate', Group(1), Group(2), Group(3), Group(4)]
+    else:
+        return None
 
-    if DEBUG:
-        print(DEBUG_MSG)
+def compileScript(f, base, prefix=''):
+    """A pair (STEPS, DEPS), where STEPS is the compiled form of the test
+    script in file F (with includes taken relative to directory BASE and
+    line numbers prefixed with PREFIX), and DEPS maps the full names of
+    the files it came from to the hashes of their contents.  Each step is
+    a list [LINE_NUM, LINE, KIND, ARGS...], where LINE is the text of the
+    instruction (used with --verbose).  For ">" commands, LINE_NUM is
+    that of the terminating <<< and ARGS are the command, a list of the
+    expected output lines, and whether they are regular expressions.
+    Problems that interpreting the script would report when reached
+    become steps of KIND 'fault' or 'unterminated'."""
+    steps, deps = [], {}
+    inp = line_reader(f, prefix, deps)
+    line_num = None
+    try:
+        while True:
+            line_num, line = next(inp, (line_num, ''))
+            if line == "":
+                return steps, deps
+            if "${" in line and not Match(r'\s*#', line) \
+               and not Match(r'>\s*(.*)', line):
+                steps.append([line_num, line, 'dynamic'])
+                continue
+            step = parseLine(line)
+            if step is None:
+                steps.append([line_num, line, 'fault',
+                              "bad test line at {}".format(line_num)])
+                return steps, deps
+            steps.append([line_num, line] + step)
+            if step[0] == 'include':
+                inp.send(join(base, step[1]))
+            elif step[0] == 'command':
+                expected = []
+                while True:
+                    line_num, L = next(inp, (line_num, ''))
+                    if L == '':
+                        steps[-1][2] = 'unterminated'
+                        return steps, deps
+                    L = L.rstrip()
+                    if Match(r'<<<(\*?)', L):
+                        break
+                    expected.append(L)
+                steps[-1][0:1] = [line_num]
+                steps[-1] += [expected, Group(1) == '*']
+    except ValueError as excp:
+        steps.append([line_num, "", 'fault', excp.args[0]])
+        return steps, deps
+
+scripts = {}
+scripts_changed = False
+scripts_lock = Lock()
 
-    timeout = TIMEOUT
-    defns = {}
+def loadScripts():
+    global scripts
+    try:
+        with open(join(CACHE_DIR, "scripts.json")) as inp:
+            scripts = json.load(inp)
+        if type(scripts) is not dict:
+            scripts = {}
+    except (OSError, ValueError):
+        scripts = {}
 
-    def do_substs(L):
+def saveScripts():
+    if not scripts_changed:
+        return
+    try:
+        makedirs(CACHE_DIR, exist_ok=True)
+        tmp = join(CACHE_DIR, "scripts.json.tmp")
+        with open(tmp, "w") as out:
+            json.dump(scripts, out)
+        replace(tmp, join(CACHE_DIR, "scripts.json"))
+    except OSError:
+        pass
+
+# SHA-256 digests of the test scripts and included files read during this
+# run, by absolute path, so that each is read at most once per run.
+dep_hashes = {}
+
+def fileHash(name):
+    try:
+        with open(name, 'rb') as inp:
+            return hashlib.sha256(inp.read()).hexdigest()
+    except OSError:
+        return None
+
+def depHash(name):
+    """The digest of the script or included file NAME (an absolute path),
+    as of its first use in this run."""
+    with scripts_lock:
+        if name in dep_hashes:
+            return dep_hashes[name]
+    digest = fileHash(name)
+    with scripts_lock:
+        return dep_hashes.setdefault(name, digest)
+
+def scriptSteps(f, base, prefix=''):
+    """The compiled form of the test script F (as for compileScript),
+    taken from the cache of compiled scripts if F and its includes are
+    unchanged."""
+    global scripts_changed
+    key = "\0".join((abspath(f), abspath(base), prefix))
+    with scripts_lock:
+        entry = scripts.get(key)
+    if type(entry) is dict and entry.get('version') == SCRIPT_VERSION \
+       and entry.get('deps') \
+       and all(depHash(dep) == digest
+               for dep, digest in entry['deps'].items()):
+        return entry['steps']
+    steps, deps = compileScript(f, base, prefix)
+    with scripts_lock:
+        for dep, digest in deps.items():
+            dep_hashes.setdefault(dep, digest)
+        scripts[key] = { 'version': SCRIPT_VERSION, 'deps': deps,
+                         'steps': steps }
+        scripts_changed = True
+    return steps
+
+class ScriptState:
+    """The variables of a test script executing in directory TMPDIR: its
+    current directory, timeout, definitions (D), captured groups of the
+    last ">" command, and included files."""
+
+    def __init__(self, tmpdir):
+        self.tmpdir = self.cdir = tmpdir
+        self.timeout = TIMEOUT
+        self.defns = {}
+        self.last_groups = []
+        self.included_files = []
+
+    def moveTo(self, tmpdir):
+        """A copy of this state for a copy of its directory in TMPDIR."""
+        result = ScriptState(tmpdir)
+        result.cdir = normpath(join(tmpdir, relpath(self.cdir, self.tmpdir)))
+        result.timeout = self.timeout
+        result.defns = dict(self.defns)
+        result.last_groups = list(self.last_groups)
+        result.included_files = list(self.included_files)
+        return result
+
+    def substitute(self, L):
+        """L with its substitutions (${...}) replaced."""
         c = 0
         L0 = None
         while L0 != L and c < 10:
             c += 1
             L0 = L
-            L = re.sub(r'\$\{(.*?)\}', subst_var, L)
+            L = re.sub(r'\$\{(.*?)\}', self._substVar, L)
         return L
 
-    def subst_var(M):
+    def _substVar(self, M):
         key = M.group(1)
         if Match(r'\d+$', key):
             try:
-                return last_groups[int(key)]
+                return self.last_groups[int(key)]
             except IndexError:
                 raise ValueError("FAILED (nonexistent group: {{{}}})"
                                  .format(key))
-        elif M.group(1) in defns:
-            return defns[M.group(1)]
+        elif M.group(1) in self.defns:
+            return self.defns[M.group(1)]
         else:
             raise ValueError("undefined substitution: ${{{}}}".format(M.group(1)))
 
-    try:
-        line_num = None
-        inp = line_reader(test, '')
-        included_files = []
-        while True:
-            line_num, line = next(inp, (line_num, ''))
-            if line == "":
-                print("OK")
-                return True
-            if not Match(r'\s*#', line):
-                line = do_substs(line)
-            if verbose:
-                print("+ {}".format(line.rstrip()))
-            if Match(r'\s*#', line) or Match(r'\s+$', line):
-                pass
-            elif Match(r'I\s+(\S+)', line):
-                inp.send(join(dirname(test), Group(1)))
-                included_files.append(Group(1))
-            elif Match(r'C\s*(\S*)', line):
-                if Group(1) == "":
-                    cdir = tmpdir
-                else:
-                    cdir = join(tmpdir, Group(1))
-                    if not exists(cdir):
-                        mkdir(cdir)
-            elif Match(r'T\s*(\S+)', line):
-                try:
-                    timeout = float(Group(1))
-                except:
-                    ValueError("bad time: {}".format(line))
-            elif Match(r'\+\s*(\S+)\s+(\S+)', line):
-                doCopy(Group(1), Group(2), cdir)
-            elif Match(r'-\s*(\S+)', line):
-                doDelete(Group(1), cdir)
-            elif Match(r'>\s*(.*)', line):
-                cmnd = Group(1)
-                expected = []
-                while True:
-                    line_num, L = next(inp, (line_num, ''))
-                    if L == '':
-                        raise ValueError("unterminated command: {}"
-                                         .format(line))
-                    L = L.rstrip()
-                    if Match(r'<<<(\*?)', L):
-                        is_regexp = Group(1)
-                        break
-                    expected.append(do_substs(L))
-                msg, out = doExecute(cmnd, cdir, timeout, line_num)
-                if verbose:
-                    if out:
-                        print(re.sub(r'(?m)^', '- ', chop_nl(out)))
-                if msg == "OK":
-                    if not correctProgramOutput(expected, out, last_groups,
-                                                is_regexp):
-                        msg = "incorrect output"
-                if msg != "OK":
-                    print("ERROR ({})".format(msg))
-                    reportDetails(test, included_files, line_num)
-                    return False
-            elif Match(r'=\s*(\S+)\s+(\S+)', line):
-                if not correctFileOutput(Group(1), Group(2), cdir):
-                    print("ERROR (file {} has incorrect content)"
-                          .format(Group(1)))
-                    reportDetails(test, included_files, line_num)
-                    return False
-            elif Match(r'\*\s*(\S+)', line):
-                if fileExists(Group(1), cdir):
-                    print("ERROR (file {} present)".format(Group(1)))
-                    reportDetails(test, included_files, line_num)
-                    return False
-            elif Match(r'E\s*(\S+)', line):
-                if not fileExists(Group(1), cdir):
-                    print("ERROR (file or directory {} not present)"
-                          .format(Group(1)))
-                    reportDetails(test, included_files, line_num)
-                    return False
-            elif Match(r'(?s)D\s*([a-zA-Z_][a-zA-Z_0-9]*)\s*"(.*)"\s*$', line):
-                defns[Group(1)] = Group(2)
-            else:
+def executeSteps(test, steps, state):
+    """Execute STEPS, an iterable of steps of the compiled form of test
+    script TEST, in STATE.  Returns None if all of them succeed, and
+    otherwise a pair (MSG, LINE_NUM) describing the first to fail.
+    Raises ValueError if the script is erroneous."""
+    pending = [ iter(steps) ]
+    while True:
+        step = next(pending[-1], None)
+        if step is None:
+            pending.pop()
+            if pending:
+                continue
+            return None
+        line_num, line, kind = step[0:3]
+        dynamic = kind == 'dynamic'
+        if dynamic:
+            line = state.substitute(line)
+            step = parseLine(line)
+            if step is None or step[0] == 'command':
                 raise ValueError("bad test line at {}".format(line_num))
+            step = [line_num, line] + step
+            kind = step[2]
+        elif kind not in ('nop', 'fault') and line:
+            line = state.substitute(line)
+        if verbose and line:
+            print("+ {}".format(line.rstrip()))
+        if kind == 'nop':
+            pass
+        elif kind == 'fault':
+            raise ValueError(step[3])
+        elif kind == 'unterminated':
+            raise ValueError("unterminated command: {}".format(line))
+        elif kind == 'include':
+            state.included_files.append(step[3])
+            if dynamic:
+                pending.append(iter(scriptSteps(join(dirname(test), step[3]),
+                                                dirname(test),
+                                                line_num + ".")))
+        elif kind == 'cd':
+            if step[3] == "":
+                state.cdir = state.tmpdir
+            else:
+                state.cdir = join(state.tmpdir, step[3])
+                if not exists(state.cdir):
+                    mkdir(state.cdir)
+        elif kind == 'timeout':
+            state.timeout = step[3]
+        elif kind == 'copy':
+            doCopy(step[3], step[4], state.cdir)
+        elif kind == 'delete':
+            doDelete(step[3], state.cdir)
+        elif kind == 'generate':
+            doGenerate(step[3], step[4], step[5], step[6], state.cdir)
+        elif kind == 'command':
+            cmnd = state.substitute(step[3])
+            expected = [ state.substitute(L) for L in step[4] ]
+            is_regexp = step[5]
+            if profile_file and not DEBUG:
+                size = repositorySize(state.cdir)
+            start = monotonic()
+            msg, out = doExecute(cmnd, state.cdir, state.timeout, line_num)
+            if profile_file and not DEBUG:
+                recordCommand(test, line_num, cmnd, monotonic() - start,
+                              size, msg)
+            if verbose:
+                if out:
+                    print(re.sub(r'(?m)^', '- ', chop_nl(out)))
+            if msg == "OK":
+                if not correctProgramOutput(expected, out, state.last_groups,
+                                            is_regexp):
+                    msg = "incorrect output"
+            if msg != "OK":
+                return msg, line_num
+        elif kind == 'same':
+            if not correctFileOutput(step[3], step[4], state.cdir):
+                return ("file {} has incorrect content".format(step[3]),
+                        line_num)
+        elif kind == 'absent':
+            if fileExists(step[3], state.cdir):
+                return "file {} present".format(step[3]), line_num
+        elif kind == 'present':
+            if not fileExists(step[3], state.cdir):
+                return ("file or directory {} not present".format(step[3]),
+                        line_num)
+        elif kind == 'define':
+            state.defns[step[3]] = step[4]
+
+# Maps tests to pairs (N, STATE), where STATE is the state after running
+# the first N steps of the test's compiled script in the directory
+# STATE.tmpdir.
+snapshots = {}
+
+def sharedPrefixes(files):
+    """Returns a pair (PREFIXES, TESTS) describing the prefixes of the
+    compiled scripts of FILES that tests share, as described for
+    --share-prefixes.  PREFIXES maps each such prefix, as a tuple of
+    signatures of its steps other than comments (which determine the
+    results of executing them), to a test that begins with
+    it.  TESTS maps each test that begins with one of them to a pair
+    (PREFIX, ENDS), where PREFIX is the longest of them and ENDS[K] is the
+    number of steps in the test's script up through its Kth step other than
+    a comment."""
+    signatures = {}
+    for test in files:
+        sig, ends = [], [0]
+        for n, step in enumerate(scriptSteps(test, dirname(test)), 1):
+            if step[2] in ('fault', 'unterminated'):
+                break
+            if step[2] == 'dynamic':
+                sig.append(json.dumps([step[1], abspath(dirname(test))]))
+                ends.append(n)
+            elif step[2] != 'nop':
+                sig.append(json.dumps(step[2:]))
+                ends.append(n)
+        signatures[test] = sig, ends
+    order = sorted(files, key=lambda test: signatures[test][0])
+    shared = { test: 0 for test in files }
+    for test0, test1 in zip(order, order[1:]):
+        sig0, sig1 = signatures[test0][0], signatures[test1][0]
+        k = 0
+        while k < min(len(sig0), len(sig1)) and sig0[k] == sig1[k]:
+            k += 1
+        shared[test0] = max(shared[test0], k)
+        shared[test1] = max(shared[test1], k)
+    prefixes, tests = {}, {}
+    for test in files:
+        sig, ends = signatures[test]
+        k = shared[test]
+        while k > 0 and not sig[k - 1].startswith('["command"'):
+            k -= 1
+        if k > 0:
+            prefix = tuple(sig[:k])
+            prefixes.setdefault(prefix, test)
+            tests[test] = prefix, ends
+    return prefixes, tests
+
+def makeSnapshots(files):
+    """Execute the prefixes of FILES that tests share (see sharedPrefixes)
+    and record the results in snapshots.  Returns the list of directories
+    created for them."""
+    prefixes, tests = sharedPrefixes(files)
+    dirs = []
+    states = {}
+    for prefix in sorted(prefixes, key=len):
+        test = prefixes[prefix]
+        ends = tests[test][1]
+        start = ()
+        for k in range(len(prefix) - 1, 0, -1):
+            if prefix[:k] in states:
+                start = prefix[:k]
+                break
+        if start and states[start] is None:
+            states[prefix] = None
+            continue
+        tmpdir = createTempDir("prefix")
+        dirs.append(tmpdir)
+        if start:
+            cloneTree(states[start].tmpdir, tmpdir)
+            state = states[start].moveTo(tmpdir)
+        else:
+            state = ScriptState(tmpdir)
+        steps = scriptSteps(test, dirname(test))
+        try:
+            if executeSteps(test, steps[ends[len(start)]:ends[len(prefix)]],
+                            state) is not None:
+                state = None
+        except ValueError:
+            state = None
+        finally:
+            stopServers(tmpdir)
+        states[prefix] = state
+    for test, (prefix, ends) in tests.items():
+        if states[prefix] is not None:
+            snapshots[test] = ends[len(prefix)], states[prefix]
+    return dirs
+
+def doTest(test):
+    base = splitext(basename(test))[0]
+    print("{}: ".format(base), end="")
+    tmpdir = createTempDir(base)
+
+    if verbose:
+        print("Testing directory: {}".format(tmpdir))
+
+    if DEBUG:
+        print(DEBUG_MSG)
+
+    steps = scriptSteps(test, dirname(test))
+    if test in snapshots:
+        n, snapshot = snapshots[test]
+        cloneTree(snapshot.tmpdir, tmpdir)
+        state = snapshot.moveTo(tmpdir)
+        steps = steps[n:]
+    else:
+        state = ScriptState(tmpdir)
+
+    try:
+        failure = executeSteps(test, steps, state)
+        if failure is None:
+            print("OK")
+            return True
+        msg, line_num = failure
+        print("ERROR ({})".format(msg))
+        reportDetails(test, state.included_files, line_num)
+        return False
     finally:
+        stopServers(tmpdir)
         if not keep:
             cleanTempDir(tmpdir)
 
+def runTest(test):
+    """Run TEST, returning a triple (OUTCOME, REASON, DURATION), where
+    OUTCOME is 'passed', 'failed', or 'faulty' (for an erroneous test),
+    REASON is the error in a faulty test, and DURATION is the elapsed
+    time."""
+    start = monotonic()
+    outcome, reason = 'passed', None
+    try:
+        if not doTest(test):
+            outcome = 'failed'
+    except ValueError as excp:
+        print("FAILED ({})".format(excp.args[0]))
+        outcome, reason = 'faulty', excp.args[0]
+    return outcome, reason, monotonic() - start
+
+def runBufferedTest(test):
+    """Run TEST as for runTest, returning its result and a list of the
+    text it printed and the arguments of its calls to reportDetails, in
+    order."""
+    output.buffer = []
+    try:
+        return runTest(test), output.buffer
+    finally:
+        output.buffer = None
+
 if __name__ == "__main__":
     show = None
     keep = False
@@ -395,12 +1332,20 @@ if __name__ == "__main__":
     verbose = False
     src_dir = 'src'
     output_tolerance = 3
+    shard = None
+    json_report = None
+    merge = False
+    jobs = 1
+    scratch_root = None
+    profile_file = None
+    share_prefixes = False
 
     try:
         opts, files = \
-            getopt(sys.argv[1:], '',
+            getopt(sys.argv[1:], 'j:',
                    ['show=', 'keep', 'progdir=', 'verbose', 'src=',
-                    'tolerance=', 'debug'])
+                    'tolerance=', 'debug', 'shard=', 'json=', 'merge',
+                    'jvm', 'jobs=', 'scratch=', 'profile=', 'share-prefixes'])
         for opt, val in opts:
             if opt == '--show':
                 val = val.lower()
@@ -414,6 +1359,8 @@ if __name__ == "__main__":
                 keep = True
             elif opt == "--progdir":
                 prog_dir = val
+            elif opt == "--scratch":
+                scratch_root = val
             elif opt == "--src":
                 src_dir = abspath(val)
             elif opt == "--verbose":
@@ -422,6 +1369,30 @@ if __name__ == "__main__":
                 output_tolerance = int(val)
             elif opt == "--debug":
                 DEBUG = True
+            elif opt == "--shard":
+                if not Match(r'(\d+)/(\d+)$', val) \
+                   or not 1 <= int(Group(1)) <= int(Group(2)):
+                    Usage()
+                shard = int(Group(1)), int(Group(2))
+            elif opt == "--json":
+                json_report = val
+            elif opt == "--profile":
+                profile_file = val
+            elif opt == "--merge":
+                merge = True
+            elif opt == "--jvm":
+                USE_SERVER = True
+            elif opt in ("-j", "--jobs"):
+                jobs = int(val)
+            elif opt == "--share-prefixes":
+                share_prefixes = True
+        if merge:
+            num_tests, passed, results = mergeReports(files)
+            saveHistory(results)
+            if json_report:
+                writeReport(json_report, num_tests, passed, results)
+            reportTotals(num_tests, passed)
+            sys.exit(0 if passed == num_tests else 1)
         if prog_dir is None:
             prog_dir = abspath(getcwd())
             k = 10
@@ -439,33 +1410,71 @@ if __name__ == "__main__":
         print(USAGE)
         sys.exit(0)
 
+    # Make the class path absolute, since gitlet.Main runs in the test
+    # directories, and GitletServers must find the same classes.
+    environ['CLASSPATH'] = \
+        pathsep.join(abspath(entry) for entry
+                     in [prog_dir] + environ['CLASSPATH'].split(pathsep)
+                     if entry)
     ON_WINDOWS = Match(r'.*\\', join('a', 'b'))
-    if ON_WINDOWS:
-        environ['CLASSPATH'] = "{};{}".format(prog_dir, environ['CLASSPATH'])
-    else:
-        environ['CLASSPATH'] = "{}:{}".format(prog_dir, environ['CLASSPATH'])
+    if not ON_WINDOWS:
         JAVA_COMMAND = 'exec ' + JAVA_COMMAND
 
+    if shard:
+        files = shardTests(files, shard[0], shard[1], loadHistory())
+
+    files = [ test for test in files if exists(test) ]
+    if scratch_root is None and not keep:
+        scratch_root = ramDirectory()
+    if scratch_root is None:
+        scratch_dir = abspath(getcwd())
+        atexit.register(finishCleanup, None)
+    else:
+        scratch_dir = mkdtemp(prefix="gitlet-tests-", dir=scratch_root)
+        atexit.register(finishCleanup, None if keep else scratch_dir)
+    Thread(target=reapDirectories, daemon=True).start()
+    loadScripts()
     num_tests = len(files)
+    snapshot_dirs = []
+    if share_prefixes and not verbose and not DEBUG:
+        snapshot_dirs = makeSnapshots(files)
     errs = 0
     fails = 0
+    results = []
 
-    for test in files:
-        try:
-            if not exists(test):
-                num_tests -= 1
-            elif not doTest(test):
-                errs += 1
-                if type(show) is int:
-                    show -= 1
-        except ValueError as excp:
-            print("FAILED ({})".format(excp.args[0]))
+    if jobs == 1 or DEBUG:
+        outcomes = ( (runTest(test), None) for test in files )
+    else:
+        sys.stdout = TestOutput(sys.stdout)
+        pool = ThreadPoolExecutor(max_workers=jobs or cpu_count())
+        outcomes = pool.map(runBufferedTest, files)
+
+    for test, ((outcome, reason, duration), buffer) in zip(files, outcomes):
+        for item in buffer or ():
+            if type(item) is str:
+                sys.stdout.write(item)
+            else:
+                reportDetails(*item)
+        if outcome == 'failed':
+            errs += 1
+            if type(show) is int:
+                show -= 1
+        elif outcome == 'faulty':
             fails += 1
+        results.append({ 'id': test, 'outcome': outcome, 'reason': reason,
+                         'usage': { 'wall': duration } })
 
-    print()
-    print("Ran {} tests. ".format(num_tests), end="")
-    if errs == fails == 0:
-        print("All passed.")
-    else:
-        print("{} passed.".format(num_tests - errs - fails))
+    for dir in snapshot_dirs:
+        cleanTempDir(dir)
+    saveScripts()
+    if not shard:
+        saveHistory(results)
+    if json_report:
+        writeReport(json_report, num_tests, num_tests - errs - fails,
+                    results)
+    if profile_file:
+        writeProfile(profile_file, files)
+        reportProfile()
+    reportTotals(num_tests, num_tests - errs - fails)
+    if errs or fails:
         sys.exit(1)
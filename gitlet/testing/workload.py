@@ -0,0 +1,301 @@
+import sys, re, csv, random
+from os.path import join
+from os import makedirs
+from getopt import getopt, GetoptError
+from math import log
+
+SHORT_USAGE = """\
+Usage: python3 workload.py OPTIONS
+       python3 workload.py --curves=PROFILE.csv
+
+   OPTIONS may include
+       --commits=N,...   Generate a script for each number N of commits
+                         (default 50).
+       --branches=B      Number of branches besides master (default 2).
+       --merge-every=M   Merge a branch into master after every M commits
+                         (default 10; 0 for no merges).
+       --files=K         Number of files changed by each commit (default 2).
+       --checks=C        Number of times to check the repository with log,
+                         global-log, find, checkout, and status (default 4).
+       --seed=S          Seed for the choice of branches (default 0).
+       --out=DIR         Directory for the scripts (default .).
+       --name=NAME       Call the scripts NAME-N.in (default "workload").
+       --curves=FILE     Summarize the timings in FILE, as written by
+                         tester.py --profile=FILE, as scaling curves.
+"""
+
+USAGE = SHORT_USAGE + """\
+
+Generates gitlet test scripts (in the form accepted by tester.py and
+runner.py) that build a history of N commits spread at random over master
+and B other branches, merging a branch that has new commits into master
+after every M commits.  Each commit changes K files, which belong to the
+branch on which it is made, so that merges never conflict.  The files'
+contents come from src/.  The scripts check the repository C times, evenly
+spaced through the history, and at the end, on master, with
+
+   status           Checked exactly.
+   log              Checked exactly against the messages of the commits on
+                    master's first-parent history, capturing their ids.
+   find MSG         For a commit about halfway along that history.
+   global-log       Checked to contain the current commit.
+   checkout ID -- F Checks out a file from the same commit, checks its
+                    contents, and restores it with checkout -- F.
+
+Branch switches (checkout) and merges happen as part of the history.  To
+find how the times of these commands grow, run the scripts with
+
+   python3 tester.py --profile=PROFILE.csv workload-*.in
+
+and then
+
+   python3 workload.py --curves=PROFILE.csv
+
+which prints, for each gitlet command, its mean time for repositories
+with increasing numbers of commits (grouped by powers of 2), and the
+exponent E of the best fit of time as proportional to COMMITS**E.  An
+exponent well over 1 indicates super-linear growth."""
+
+# Contents of changed files, from src/.
+FIXTURES = ("wug.txt", "notwug.txt", "wug2.txt", "wug3.txt")
+
+DEFINITIONS = r"""# Definitions
+D DATE "Date: \w\w\w \w\w\w \d+ \d\d:\d\d:\d\d \d\d\d\d [-+]\d\d\d\d"
+# A log entry's header.  Captures the commit id.
+D HEADER "commit ([a-f0-9]+)[ \t]*\n(?:Merge:\s+[0-9a-f]{7}\s+[0-9a-f]{7}[ ]*\n)?${DATE}"
+# Any text.
+D ANY "[\s\S]*"
+"""
+
+def Usage():
+    print(SHORT_USAGE, file=sys.stderr)
+    sys.exit(1)
+
+class Branch:
+    """The state of a branch while generating a script: the contents of
+    its files (as names of files in src/), the number of commits made on
+    it, and whether it has commits not yet merged into master."""
+
+    def __init__(self, name):
+        self.name = name
+        self.contents = {}
+        self.commits = 0
+        self.unmerged = False
+
+def generate(out, commits, branches, merge_every, files, checks, seed):
+    """Write a script to OUT with COMMITS commits, as described in USAGE
+    for the remaining parameters."""
+    rand = random.Random(seed)
+    master = Branch("master")
+    others = [ Branch("b{}".format(n)) for n in range(1, branches + 1) ]
+    # Messages and file contents of master's first-parent history.
+    history = [ ("initial commit", {}) ]
+    # Number of master commits since each other branch was last merged.
+    master_since = { b.name: 0 for b in others }
+    current = master
+    check_points = { commits * k // checks for k in range(1, checks) } \
+                   if checks > 0 else set()
+
+    def emit(line):
+        print(line, file=out)
+
+    def switchTo(branch):
+        nonlocal current
+        if branch is not current:
+            emit("> checkout {}".format(branch.name))
+            emit("<<<")
+            current = branch
+
+    def commit(branch, message):
+        switchTo(branch)
+        for k in range(files):
+            name = "{}-{}.txt".format(branch.name,
+                                      (branch.commits * files + k)
+                                      % (2 * files))
+            old = branch.contents.get(name)
+            new = FIXTURES[(FIXTURES.index(old) + 1) % len(FIXTURES)] \
+                  if old else FIXTURES[0]
+            branch.contents[name] = new
+            emit("+ {} {}".format(name, new))
+            emit("> add {}".format(name))
+            emit("<<<")
+        emit('> commit "{}"'.format(message))
+        emit("<<<")
+        branch.commits += 1
+        if branch is master:
+            history.append((message, dict(master.contents)))
+            for name in master_since:
+                master_since[name] += 1
+        else:
+            branch.unmerged = True
+
+    def merge(branch):
+        if master_since[branch.name] == 0:
+            commit(master, "m{} on master".format(len(history)))
+        switchTo(master)
+        emit("> merge {}".format(branch.name))
+        emit("<<<")
+        master.contents.update(branch.contents)
+        history.append(("Merged {} into master.".format(branch.name),
+                        dict(master.contents)))
+        for name in master_since:
+            master_since[name] += 1
+        master_since[branch.name] = 0
+        branch.unmerged = False
+
+    def check():
+        switchTo(master)
+        emit("# Check the repository after {} commits on master."
+             .format(len(history)))
+        emit("> status")
+        emit("=== Branches ===")
+        for name in sorted(["master"] + [ b.name for b in others ]):
+            emit(r"\*master" if name == "master" else name)
+        emit("")
+        for section in ("Staged Files", "Removed Files",
+                        "Modifications Not Staged For Commit",
+                        "Untracked Files"):
+            emit("=== {} ===".format(section))
+            emit("")
+        emit("<<<*")
+        emit("> log")
+        for message, contents in reversed(history):
+            emit("===")
+            emit("${HEADER}")
+            emit(re.escape(message))
+            emit("")
+        emit("<<<*")
+        emit('D HEAD "${1}"')
+        mid = len(history) // 2
+        while mid > 0 and history[mid][0].startswith("Merged "):
+            mid -= 1
+        emit('D MID "${{{}}}"'.format(len(history) - mid))
+        emit('> find "{}"'.format(history[mid][0]))
+        emit("${MID}")
+        emit("<<<")
+        emit("> global-log")
+        emit("${ANY}commit ${HEAD}${ANY}")
+        emit("<<<*")
+        common = sorted(set(history[mid][1]) & set(master.contents))
+        if common:
+            name = common[0]
+            emit("> checkout ${{MID}} -- {}".format(name))
+            emit("<<<")
+            emit("= {} {}".format(name, history[mid][1][name]))
+            emit("> checkout -- {}".format(name))
+            emit("<<<")
+            emit("= {} {}".format(name, master.contents[name]))
+
+    emit("# Generated by workload.py: {} commits, {} branches, merge every "
+         "{}, {} files per commit, seed {}."
+         .format(commits, branches, merge_every, files, seed))
+    emit("> init")
+    emit("<<<")
+    emit(DEFINITIONS.rstrip())
+    for b in others:
+        emit("> branch {}".format(b.name))
+        emit("<<<")
+    for n in range(1, commits + 1):
+        branch = rand.choice([master] + others)
+        commit(branch, "c{} on {}".format(n, branch.name))
+        if merge_every > 0 and n % merge_every == 0:
+            unmerged = [ b for b in others if b.unmerged ]
+            if unmerged:
+                merge(rand.choice(unmerged))
+        if n in check_points:
+            check()
+    check()
+
+def powerOf2Above(n):
+    """The least power of 2 that is at least N (at least 1)."""
+    k = 1
+    while k < n:
+        k *= 2
+    return k
+
+def growthExponent(points):
+    """The slope of the least-squares line through the points (log X,
+    log Y) for the pairs (X, Y) in POINTS with positive X and Y, or None
+    if there are fewer than two distinct X's."""
+    points = [ (log(x), log(y)) for x, y in points if x > 0 and y > 0 ]
+    if len({ x for x, y in points }) < 2:
+        return None
+    mx = sum(x for x, y in points) / len(points)
+    my = sum(y for x, y in points) / len(points)
+    return sum((x - mx) * (y - my) for x, y in points) \
+        / sum((x - mx) ** 2 for x, y in points)
+
+def reportCurves(filename):
+    """Print scaling curves for the timings in the profile FILENAME."""
+    times = {}
+    with open(filename, newline="") as inp:
+        for row in csv.DictReader(inp):
+            if row['outcome'] != "OK":
+                continue
+            commits, seconds = int(row['commits']), float(row['seconds'])
+            times.setdefault(row['command'], []).append((commits, seconds))
+    for command in sorted(times):
+        samples = times[command]
+        buckets = {}
+        for commits, seconds in samples:
+            buckets.setdefault(powerOf2Above(commits), []).append(seconds)
+        print("{}:".format(command))
+        for bound in sorted(buckets):
+            values = buckets[bound]
+            print("    <= {:>6} commits: {:>4} runs, mean {:.4f} sec."
+                  .format(bound, len(values), sum(values) / len(values)))
+        exponent = growthExponent(samples)
+        if exponent is not None:
+            print("    growth exponent {:.2f}".format(exponent))
+
+if __name__ == "__main__":
+    counts = [50]
+    branches = 2
+    merge_every = 10
+    files = 2
+    checks = 4
+    seed = 0
+    out_dir = "."
+    name = "workload"
+    curves = None
+
+    try:
+        opts, args = \
+            getopt(sys.argv[1:], '',
+                   ['commits=', 'branches=', 'merge-every=', 'files=',
+                    'checks=', 'seed=', 'out=', 'name=', 'curves='])
+        for opt, val in opts:
+            if opt == "--commits":
+                counts = [ int(n) for n in val.split(",") ]
+            elif opt == "--branches":
+                branches = int(val)
+            elif opt == "--merge-every":
+                merge_every = int(val)
+            elif opt == "--files":
+                files = int(val)
+            elif opt == "--checks":
+                checks = int(val)
+            elif opt == "--seed":
+                seed = int(val)
+            elif opt == "--out":
+                out_dir = val
+            elif opt == "--name":
+                name = val
+            elif opt == "--curves":
+                curves = val
+    except (GetoptError, ValueError):
+        Usage()
+    if args or files < 1 or branches < 0 or min(counts) < 1:
+        Usage()
+
+    if curves:
+        reportCurves(curves)
+        sys.exit(0)
+
+    makedirs(out_dir, exist_ok=True)
+    for commits in counts:
+        filename = join(out_dir, "{}-{}.in".format(name, commits))
+        with open(filename, "w") as out:
+            generate(out, commits, branches, merge_every, files, checks,
+                     seed)
+        print(filename)